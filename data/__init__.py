@@ -9,8 +9,16 @@ Now you can use the dataset class by specifying flag '--dataset_mode dummy'.
 See our template dataset class 'template_dataset.py' for more details.
 """
 import importlib
+import functools
+import math
 import torch.utils.data
-from data.base_dataset import BaseDataset
+import torch.nn.functional as F
+from data.base_dataset import BaseDataset, add_partial_images, LABEL_KEYS
+from data.prefetcher import DevicePrefetcher
+from data.batch_augment import BatchAugmenter
+from data.thread_loader import ThreadBatchLoader
+from data.batch_ring import SharedBatchRing
+from data.samplers import InfiniteSampler, BucketBatchSampler
 
 
 def find_dataset_using_name(dataset_name):
@@ -54,6 +62,66 @@ def create_dataset(opt):
     return dataset
 
 
+def collate_uint8(batch):
+    """Stack the uint8 tensors of a list of samples and gather their paths into lists.
+    Used with '--uint8_batches': no dtype conversion happens in the workers, so the batches that
+    cross the process boundary are 4x smaller than float32 ones.
+    """
+    collated = {}
+    for key, value in batch[0].items():
+        if isinstance(value, torch.Tensor):
+            collated[key] = torch.stack([sample[key] for sample in batch], 0)
+        else:
+            collated[key] = [sample[key] for sample in batch]
+    return collated
+
+
+def is_image(value):
+    return isinstance(value, torch.Tensor) and value.dim() == 3
+
+
+def collate_padded(batch):
+    """Collate samples of different sizes into one batch.
+    Every image tensor is padded at the bottom/right to the largest height and width of the batch,
+    rounded up to a multiple of 4, and the original sizes are recorded in 'A_hw' and 'B_hw' so that
+    the model can strip the padding again. Used with '--size_buckets'; float tensors are padded
+    with -1 and uint8 tensors with 0, i.e. black in both cases.
+    """
+    keys = [key for key, value in batch[0].items() if is_image(value)]
+    h = max(sample[key].shape[1] for sample in batch for key in keys)
+    w = max(sample[key].shape[2] for sample in batch for key in keys)
+    h, w = -(-h // 4) * 4, -(-w // 4) * 4
+    collated = {}
+    for key, value in batch[0].items():
+        if key in keys:
+            fill = 0 if value.dtype == torch.uint8 else -1
+            padded = [F.pad(sample[key], (0, w - sample[key].shape[2], 0, h - sample[key].shape[1]), value=fill) for sample in batch]
+            collated[key] = torch.stack(padded, 0)
+        elif isinstance(value, torch.Tensor):
+            collated[key] = torch.stack([sample[key] for sample in batch], 0)
+        else:
+            collated[key] = [sample[key] for sample in batch]
+    for domain in ['A', 'B']:
+        if domain in keys:
+            collated[domain + '_hw'] = torch.tensor([list(sample[domain].shape[1:]) for sample in batch])
+    return collated
+
+
+def collate_crops(batch, collate_fn=None):
+    """Flatten data points of '--crops_per_sample', each a {'crops': [...]} list of K samples, into one
+    batch of N * K samples, and collate those with <collate_fn> (the default collate if None).
+    """
+    crops = [crop for sample in batch for crop in sample['crops']]
+    return (collate_fn or torch.utils.data.dataloader.default_collate)(crops)
+
+
+def collate_partial(batch, collate_fn=None):
+    """Collate <batch> with <collate_fn> (the default collate if None) and add the masked real images and
+    fused labels of '--precompute_partial' (see <add_partial_images>), so that the workers compute them.
+    """
+    return add_partial_images((collate_fn or torch.utils.data.dataloader.default_collate)(batch))
+
+
 class CustomDatasetDataLoader():
     """Wrapper class of Dataset class that performs multi-threaded data loading"""
 
@@ -61,16 +129,92 @@ class CustomDatasetDataLoader():
         """Initialize this class
         Step 1: create a dataset instance given the name [dataset_mode]
         Step 2: create a multi-threaded data loader.
+        With '--device_prefetch', a background thread moves the next batches to the device (see data/prefetcher.py).
+        With '--infinite_sampler', the workers are started once and every call of <__iter__> continues
+        the same stream for one logical epoch.
+        With '--size_buckets', every batch only holds samples of one image size (see <collate_padded>).
+        With '--batch_augment', training batches are augmented as a whole after collation (see data/batch_augment.py).
+        With '--loader_backend thread', threads of this process load the batches instead of worker processes (see data/thread_loader.py).
+        With '--batch_ring', the workers collate into preallocated shared-memory slots (see data/batch_ring.py).
+        With '--precompute_partial', the label-only tensors of the CycleGAN forward pass are computed per batch in
+        the workers, or after the batch augmentation if batches are augmented (see <add_partial_images>).
         """
         self.opt = opt
         dataset_class = find_dataset_using_name(opt.dataset_mode)
         self.dataset = dataset_class(opt)
         print("dataset [%s] was created" % type(self.dataset).__name__)
-        self.dataloader = torch.utils.data.DataLoader(
-            self.dataset,
-            batch_size=opt.batch_size,
-            shuffle=not opt.serial_batches,
-            num_workers=int(opt.num_threads))
+        self.device = torch.device('cuda:{}'.format(opt.gpu_ids[0])) if opt.gpu_ids else torch.device('cpu')
+        loader_args = {}
+        if int(opt.num_threads) > 0:
+            loader_args['prefetch_factor'] = opt.prefetch_factor
+            loader_args['persistent_workers'] = opt.infinite_sampler
+        self.sampler = None
+        self.steps_per_epoch = math.ceil(len(self) / opt.batch_size)
+        self.iterable = isinstance(self.dataset, torch.utils.data.IterableDataset)  # e.g. '--dataset_mode stream'
+        assert not (self.iterable and opt.infinite_sampler), '--infinite_sampler needs a map-style dataset'
+        self.epoch = getattr(opt, 'epoch_count', 1) - 1  # epoch of the next pass over an iterable dataset
+        weights = None if opt.serial_batches or self.iterable else getattr(self.dataset, 'sample_weights', None)  # e.g. --label_sampling weight
+        if opt.infinite_sampler:  # one loader iterator for the whole run; epochs are slices of <steps_per_epoch> batches
+            start_epoch = getattr(opt, 'epoch_count', 1)  # resume at the beginning of --epoch_count
+            self.sampler = InfiniteSampler(len(self.dataset), shuffle=not opt.serial_batches, seed=opt.sampler_seed,
+                                           start=(start_epoch - 1) * self.steps_per_epoch * opt.batch_size, weights=weights)
+        elif weights is not None:
+            self.sampler = torch.utils.data.WeightedRandomSampler(weights, len(weights), replacement=True)
+        batch_sampler = None
+        if opt.size_buckets:
+            assert not (self.iterable or opt.infinite_sampler or weights is not None), \
+                '--size_buckets does not support iterable datasets, --infinite_sampler or --label_sampling weight'
+            batch_sampler = BucketBatchSampler(self.dataset.sample_sizes(), opt.batch_size, shuffle=not opt.serial_batches)
+            self.steps_per_epoch = len(batch_sampler)
+        collate_fn = collate_uint8 if opt.uint8_batches else None
+        if opt.size_buckets:
+            collate_fn = collate_padded
+        if getattr(opt, 'crops_per_sample', 1) > 1:  # e.g. '--dataset_mode unaligned'
+            collate_fn = functools.partial(collate_crops, collate_fn=collate_fn)
+        self.augment = BatchAugmenter(opt) if opt.isTrain and opt.batch_augment else None
+        self.partial_after_augment = False  # compute '--precompute_partial' in <__iter__> instead of in the workers
+        if opt.precompute_partial:
+            if opt.loader_backend == 'process' and not opt.batch_ring and self.augment is None:
+                collate_fn = functools.partial(collate_partial, collate_fn=collate_fn)
+            else:  # the batch changes after the worker collation, or there are no worker processes
+                self.partial_after_augment = True
+        pin_memory = opt.device_prefetch > 0 and self.device.type == 'cuda'
+        self.ring = None
+        self.held_slot = None  # ring slot of the batch the trainer currently uses
+        if opt.batch_ring:
+            assert opt.loader_backend == 'process' and collate_fn in [None, collate_uint8] and opt.device_prefetch == 0, \
+                '--batch_ring cannot be combined with --loader_backend thread, --size_buckets, --crops_per_sample or --device_prefetch'
+            n_slots = max(int(opt.num_threads), 1) * opt.prefetch_factor + 2  # every prefetched batch, the current one and one spare
+            self.ring = SharedBatchRing(n_slots, opt.batch_size, opt.crop_size, opt.input_nc, opt.output_nc,
+                                        torch.uint8 if opt.uint8_batches else torch.float32,
+                                        torch.uint8 if opt.uint8_batches or opt.compact_labels else torch.float32)
+            collate_fn = self.ring.collate
+        if opt.loader_backend == 'thread':
+            assert not self.iterable, '--loader_backend thread needs a map-style dataset'
+            if batch_sampler is None:
+                sampler = self.sampler
+                if sampler is None:
+                    sampler = torch.utils.data.SequentialSampler(self.dataset) if opt.serial_batches else torch.utils.data.RandomSampler(self.dataset)
+                batch_sampler = torch.utils.data.BatchSampler(sampler, opt.batch_size, drop_last=False)
+            custom_collate = collate_fn not in [None, collate_uint8]  # the plain stack is done in the preallocated buffers
+            held_batches = 1 + (opt.device_prefetch if self.device.type == 'cpu' else 0)  # CPU batches are not copied by the prefetcher
+            self.dataloader = ThreadBatchLoader(self.dataset, batch_sampler, int(opt.num_threads), depth=opt.prefetch_factor,
+                                                collate_fn=collate_fn if custom_collate else None, pin_memory=pin_memory,
+                                                held_batches=held_batches)
+        elif opt.loader_backend == 'process':
+            self.dataloader = torch.utils.data.DataLoader(
+                self.dataset,
+                batch_size=opt.batch_size if batch_sampler is None else 1,
+                shuffle=not opt.serial_batches and self.sampler is None and not self.iterable and batch_sampler is None,
+                sampler=self.sampler,
+                batch_sampler=batch_sampler,
+                num_workers=int(opt.num_threads),
+                collate_fn=collate_fn,
+                pin_memory=pin_memory,
+                **loader_args)
+        else:
+            raise NotImplementedError('loader backend [%s] is not recognized' % opt.loader_backend)
+        self.batches = None       # the persistent batch iterator of '--infinite_sampler'
 
     def load_data(self):
         return self
@@ -81,7 +225,47 @@ class CustomDatasetDataLoader():
 
     def __iter__(self):
         """Return a batch of data"""
-        for i, data in enumerate(self.dataloader):
+        batches = self.dataloader
+        if self.opt.device_prefetch > 0:  # batches arrive already on the device
+            batches = DevicePrefetcher(self.dataloader, self.device, self.opt.device_prefetch,
+                                       keep_uint8=LABEL_KEYS if self.opt.compact_labels else ())
+        if self.ring is not None:
+            batches = self.ring_batches(batches)
+        if self.augment is not None:  # on the device if the batches were prefetched there
+            batches = map(self.augment, batches)
+        if self.partial_after_augment:
+            batches = map(add_partial_images, batches)
+        if self.opt.infinite_sampler:
+            if self.batches is None:
+                self.batches = iter(batches)
+            for _ in range(self.steps_per_epoch):
+                yield next(self.batches)
+            return
+        if self.iterable:  # the dataset shards and shuffles itself, given the epoch
+            self.dataset.set_epoch(self.epoch)
+        for i, data in enumerate(batches):
             if i * self.opt.batch_size >= self.opt.max_dataset_size:
                 break
             yield data
+        if self.iterable:
+            self.epoch += 1
+
+    def ring_batches(self, batches):
+        """Yield the batches of '--batch_ring' as views of their slots; a slot that was not released yet is released
+        when the next batch is requested."""
+        self.ring.reset(self.held_slot)  # the workers of the previous pass are gone; reclaim the slots of its unconsumed batches
+        for collated in batches:
+            if self.held_slot is not None:
+                self.ring.release(self.held_slot)
+            self.held_slot = collated['ring_slot']
+            yield self.ring.view(collated)
+
+    def release(self, data):
+        """Hand the '--batch_ring' slot of batch <data> back to the workers; call it after <set_input>.
+        If the model may still reference the slot (float batches on the CPU), the slot is kept until the next batch.
+        """
+        if self.ring is None or data.get('ring_slot') != self.held_slot:
+            return
+        if self.device.type == 'cuda' or (self.opt.uint8_batches and not self.opt.compact_labels):  # <set_input> copied or converted the tensors
+            self.ring.release(self.held_slot)
+            self.held_slot = None
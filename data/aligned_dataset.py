@@ -1,6 +1,7 @@
 import os
 from data.base_dataset import BaseDataset, get_params, get_transform
 from data.image_folder import make_dataset
+from data.decoders import load_image
 from PIL import Image
 import numpy as np
 
@@ -47,9 +48,9 @@ class AlignedDataset(BaseDataset):
         gt_A_line_paths = self.gt_A_line_paths[index]
         
         w, h = 256, 256
-        A = Image.open(A_paths).convert('RGB').resize((w,h))
-        gt_A_cell = Image.open(gt_A_cell_paths).convert('L').resize((w,h))
-        gt_A_line = Image.open(gt_A_line_paths).convert('L').resize((w,h))
+        A = Image.fromarray(load_image(A_paths, 'RGB', self.opt.decoder)).resize((w,h))
+        gt_A_cell = Image.fromarray(load_image(gt_A_cell_paths, 'L', self.opt.decoder)).resize((w,h))
+        gt_A_line = Image.fromarray(load_image(gt_A_line_paths, 'L', self.opt.decoder)).resize((w,h))
         gt_A = np.array(gt_A_line)
         gt_A[np.array(gt_A_cell) == 255] = 255
         gt_A = Image.fromarray(gt_A)
@@ -3,6 +3,7 @@ It also includes common transformation functions (e.g., get_transform, __scale_w
 """
 import random
 import numpy as np
+import torch
 import torch.utils.data as data
 from PIL import Image
 import torchvision.transforms as transforms
@@ -52,6 +53,12 @@ class BaseDataset(data.Dataset, ABC):
         """
         pass
 
+    def sample_sizes(self):
+        """Return the (height, width) of the input image of every data point, used by '--size_buckets'.
+        Data points with the same raw size have the same size after <get_transform>.
+        """
+        raise NotImplementedError('dataset [%s] does not support --size_buckets' % type(self).__name__)
+
 
 def get_params(opt, size):
     w, h = size
@@ -62,19 +69,23 @@ def get_params(opt, size):
     elif opt.preprocess == 'scale_width_and_crop':
         new_w = opt.load_size
         new_h = opt.load_size * h // w
-    x = 0 
-    y = 0
+    x = random.randint(0, np.maximum(0, new_w - opt.crop_size))
+    y = random.randint(0, np.maximum(0, new_h - opt.crop_size))
     flip = random.random() > 0.5
 
     return {'crop_pos': (x, y), 'flip': flip}
 
 
-def get_transform(opt, params=None, grayscale=False, method=Image.BICUBIC, convert=True):
+def get_transform(opt, params=None, grayscale=False, method=Image.BICUBIC, convert=True, label=False):
     transform_list = []
     if grayscale:
         transform_list.append(transforms.Grayscale(1))
 
-    if convert:
+    if convert and label and opt.compact_labels:
+        transform_list += [transforms.PILToTensor()]  # labels stay uint8 class maps up to the loss, see '--compact_labels'
+    elif convert and opt.uint8_batches:
+        transform_list += [transforms.PILToTensor()]  # normalized once per batch on the device, see <normalize_batch>
+    elif convert:
         transform_list += [transforms.ToTensor()]
         if grayscale:
             transform_list += [transforms.Normalize((0.5,), (0.5,))]
@@ -83,6 +94,43 @@ def get_transform(opt, params=None, grayscale=False, method=Image.BICUBIC, conve
     return transforms.Compose(transform_list)
 
 
+# batch keys of the label maps; with '--compact_labels' they stay uint8 on the device
+LABEL_KEYS = ['A_gt_cell', 'B_gt_cell', 'A_gt_line', 'B_gt_line', 'A_gt', 'B_gt']
+
+
+def normalize_batch(batch):
+    """Map a uint8 image batch to float in [-1, 1].
+    The arithmetic is the same as ToTensor() followed by Normalize(0.5, 0.5), so the result is bit-identical.
+    """
+    return batch.float().div_(255).sub_(0.5).div_(0.5)
+
+
+def add_partial_images(batch):
+    """Add the tensors of the CycleGAN forward pass that only depend on the real images and their labels.
+    For every domain D of the collated <batch> that has labels:
+        D_gt       -- the layer labels with the nuclei set to 1
+        D_edge     -- bool mask of the pixels whose layer label equals the smallest or the largest one of the batch
+        D_cell_img -- the image with the nuclei and the D_edge pixels blanked to -1
+    The rules, including ignoring a largest label below 0, are those of <CycleGANModel.forward>. uint8
+    batches are processed before <normalize_batch>, where 255 maps to 1 and 0 to -1, so the result is identical.
+    """
+    batch = dict(batch)
+    for domain in ['A', 'B']:
+        if domain + '_gt_line' not in batch:
+            continue
+        img, cell, line = batch[domain], batch[domain + '_gt_cell'], batch[domain + '_gt_line']
+        is_uint8 = line.dtype == torch.uint8
+        line_max = line.max()
+        edge = line == line.min()
+        if (line_max > 127) if is_uint8 else (line_max >= 0):  # 127 is the last uint8 value that normalizes below 0
+            edge |= line == line_max
+        nuclei = cell == (255 if is_uint8 else 1)
+        batch[domain + '_gt'] = line.masked_fill(nuclei, 255 if is_uint8 else 1)
+        batch[domain + '_edge'] = edge
+        batch[domain + '_cell_img'] = img.masked_fill(nuclei | edge, 0 if img.dtype == torch.uint8 else -1)
+    return batch
+
+
 def __make_power_2(img, base, method=Image.BICUBIC):
     ow, oh = img.size
     h = int(round(oh / base) * base)
@@ -0,0 +1,94 @@
+"""Batched data augmentation that runs on whole batches after collation.
+
+Instead of transforming every sample with PIL inside the data loading workers, <BatchAugmenter>
+draws one set of random parameters per sample and applies them with tensor ops to the whole
+batch, on whatever device the batch lives on. The image of a domain and its '_cell' and '_layer'
+masks get exactly the same crop, flip and rotation, so the labels stay aligned; the intensity
+jitter only changes the image. uint8 batches ('--uint8_batches') stay uint8.
+Augmentations ('--batch_augment', comma-separated):
+    crop   -- random --crop_size x --crop_size crop
+    flip   -- random horizontal flip (disabled by --no_flip)
+    rot90  -- random rotation by a multiple of 90 degrees (180 degrees only for non-square batches)
+    jitter -- random brightness and contrast change of at most --intensity_jitter
+"""
+import torch
+
+AUGMENTATIONS = ['crop', 'flip', 'rot90', 'jitter']
+
+
+class BatchAugmenter():
+    """Apply label-consistent random augmentations to batch dictionaries of 'A'/'B' images and their masks."""
+
+    def __init__(self, opt):
+        """Initialize the augmenter.
+
+        Parameters:
+            opt (Option class) -- stores all the experiment flags; needs to be a subclass of BaseOptions
+        """
+        self.augmentations = [name for name in opt.batch_augment.split(',') if name]
+        for name in self.augmentations:
+            if name not in AUGMENTATIONS:
+                raise NotImplementedError('batch augmentation [%s] is not recognized' % name)
+        if opt.no_flip and 'flip' in self.augmentations:
+            self.augmentations.remove('flip')
+        geometric = [name for name in self.augmentations if name in ['crop', 'flip', 'rot90']]
+        # padded '--size_buckets' batches keep their valid region at the top left ('A_hw'/'B_hw'); crops, flips and rotations would move it
+        assert not (geometric and opt.size_buckets), '--batch_augment %s cannot be combined with --size_buckets' % ','.join(geometric)
+        self.crop_size = opt.crop_size
+        self.jitter = opt.intensity_jitter
+
+    def __call__(self, batch):
+        """Return <batch> with both domains augmented independently."""
+        batch = dict(batch)
+        for domain in ['A', 'B']:
+            keys = [key for key in [domain, domain + '_gt_cell', domain + '_gt_line'] if key in batch]
+            if keys:
+                self.augment(batch, keys)
+        if 'crop' in self.augmentations:  # the label statistics describe the uncropped labels
+            for key in ['A_line_min', 'A_line_max', 'B_line_min', 'B_line_max']:
+                batch.pop(key, None)
+        return batch
+
+    def augment(self, batch, keys):
+        """Augment the tensors <keys> of <batch> in place with the same per-sample geometry; keys[0] is the image."""
+        n, _, h, w = batch[keys[0]].shape
+        device = batch[keys[0]].device
+        if 'crop' in self.augmentations and (h > self.crop_size or w > self.crop_size):
+            size_h, size_w = min(h, self.crop_size), min(w, self.crop_size)
+            y = torch.randint(0, h - size_h + 1, (n,)).to(device)
+            x = torch.randint(0, w - size_w + 1, (n,)).to(device)
+            rows = (y[:, None] + torch.arange(size_h, device=device))[:, None, :, None]  # N x 1 x size_h x 1
+            cols = (x[:, None] + torch.arange(size_w, device=device))[:, None, None, :]  # N x 1 x 1 x size_w
+            samples = torch.arange(n, device=device)[:, None, None, None]
+            for key in keys:
+                channels = torch.arange(batch[key].shape[1], device=device)[None, :, None, None]
+                batch[key] = batch[key][samples, channels, rows, cols]
+            h, w = size_h, size_w
+        if 'flip' in self.augmentations:
+            flip = (torch.rand(n) < 0.5).to(device)[:, None, None, None]
+            for key in keys:
+                batch[key] = torch.where(flip, batch[key].flip(3), batch[key])
+        if 'rot90' in self.augmentations:
+            turns = torch.randint(0, 4, (n,)) if h == w else 2 * torch.randint(0, 2, (n,))
+            for key in keys:
+                rotated = batch[key].clone()
+                for k in [1, 2, 3]:
+                    index = (turns == k).nonzero()[:, 0].to(device)
+                    if len(index):
+                        rotated[index] = torch.rot90(batch[key][index], k, dims=(2, 3))
+                batch[key] = rotated
+        if 'jitter' in self.augmentations and self.jitter > 0:
+            batch[keys[0]] = self.jitter_intensity(batch[keys[0]])
+
+    def jitter_intensity(self, images):
+        """Scale the contrast around the per-image mean and shift the brightness, both by at most +-<jitter>."""
+        n = images.shape[0]
+        contrast = (1 + (torch.rand(n) * 2 - 1) * self.jitter).to(images.device)[:, None, None, None]
+        if images.dtype == torch.uint8:
+            values = images.float()
+            brightness = ((torch.rand(n) * 2 - 1) * self.jitter * 255).to(images.device)[:, None, None, None]
+            mean = values.mean(dim=(1, 2, 3), keepdim=True)
+            return ((values - mean) * contrast + mean + brightness).round_().clamp_(0, 255).to(torch.uint8)
+        brightness = ((torch.rand(n) * 2 - 1) * self.jitter * 2).to(images.device)[:, None, None, None]  # [-1, 1] spans 2
+        mean = images.mean(dim=(1, 2, 3), keepdim=True)
+        return ((images - mean) * contrast + mean + brightness).clamp_(-1, 1)
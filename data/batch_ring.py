@@ -0,0 +1,88 @@
+"""A fixed ring of preallocated shared-memory batch slots for the DataLoader workers.
+
+By default every batch is collated into freshly allocated tensors in a worker, moved to a new
+shared-memory file and released after the step, so each iteration pays for allocations, file
+descriptors and page faults. With '--batch_ring', the slots are allocated once in the main process
+before the workers start: a worker takes a free slot from a queue, collates its samples into it in
+place and only sends the slot number (and the paths) to the trainer. The trainer hands the slot
+back with <CustomDatasetDataLoader.release> once <set_input> has copied the batch away, or
+automatically when it asks for the next batch. Slots of batches that were prefetched but never
+consumed (e.g. at the end of a '--max_dataset_size' epoch) are reclaimed with <reset>. A worker
+waiting for a slot blocks on the queue of free slot numbers instead of polling.
+Slot shapes come from --batch_size, --crop_size, --input_nc (image A) and --output_nc (image B);
+the labels have one channel. There are enough slots for all batches the workers may prefetch.
+"""
+import queue
+import multiprocessing
+import torch
+
+SLOT_TIMEOUT = 300  # seconds a worker waits for a free slot before giving up
+
+
+class SharedBatchRing():
+    """Shared-memory batch slots that DataLoader workers fill in place."""
+
+    def __init__(self, n_slots, batch_size, crop_size, input_nc, output_nc, dtype=torch.float32, label_dtype=torch.float32):
+        """Allocate the slots.
+
+        Parameters:
+            n_slots (int)       -- number of batches that can be alive at once
+            batch_size (int)    -- maximum number of samples per batch
+            crop_size (int)     -- height and width of every sample
+            input_nc (int)      -- channels of image A
+            output_nc (int)     -- channels of image B
+            dtype (torch.dtype)       -- of the images: uint8 with '--uint8_batches', float32 otherwise
+            label_dtype (torch.dtype) -- of the labels: also uint8 with '--compact_labels'
+        """
+        channels = {'A': input_nc, 'B': output_nc, 'A_gt_cell': 1, 'B_gt_cell': 1, 'A_gt_line': 1, 'B_gt_line': 1}
+        self.slots = {key: torch.empty((n_slots, batch_size, c, crop_size, crop_size), dtype=dtype if key in ['A', 'B'] else label_dtype).share_memory_()
+                      for key, c in channels.items()}
+        self.n_slots = n_slots
+        self.reset()
+
+    def acquire(self):
+        """Take a free slot from the queue and return it; wait up to SLOT_TIMEOUT seconds for one."""
+        try:
+            return self.free.get(timeout=SLOT_TIMEOUT)
+        except queue.Empty:
+            raise RuntimeError('no free batch slot for %d s; the trainer has to release every batch it receives' % SLOT_TIMEOUT)
+
+    def collate(self, batch):
+        """Collate a list of samples into a free slot; runs in the worker. Returns the slot number and the non-slot values."""
+        slot = self.acquire()
+        collated = {'ring_slot': slot, 'ring_size': len(batch), 'ring_keys': [key for key in batch[0] if key in self.slots]}
+        for key, value in batch[0].items():
+            if key in self.slots:
+                buffer = self.slots[key][slot]
+                shapes = set(tuple(sample[key].shape) for sample in batch)
+                if shapes != {tuple(buffer.shape[1:])}:
+                    self.release(slot)
+                    raise RuntimeError('--batch_ring needs samples of shape %s for %s, got %s' % (tuple(buffer.shape[1:]), key, sorted(shapes)))
+                for j, sample in enumerate(batch):
+                    buffer[j].copy_(sample[key])
+            elif isinstance(value, torch.Tensor):
+                collated[key] = torch.stack([sample[key] for sample in batch], 0)
+            else:
+                collated[key] = [sample[key] for sample in batch]
+        return collated
+
+    def view(self, collated):
+        """Return the batch of a collated slot, its tensors being views of the shared slot."""
+        batch = dict(collated)
+        slot, size = batch['ring_slot'], batch['ring_size']
+        for key in batch['ring_keys']:
+            batch[key] = self.slots[key][slot][:size]
+        return batch
+
+    def release(self, slot):
+        """Hand slot <slot> back to the workers."""
+        self.free.put(slot)
+
+    def reset(self, held_slot=None):
+        """Free every slot but <held_slot>; only call it while no worker is running.
+        The queue is replaced rather than drained, so releases still in flight from the last workers are dropped with it.
+        """
+        self.free = multiprocessing.Queue()
+        for slot in range(self.n_slots):
+            if slot != held_slot:
+                self.free.put(slot)
@@ -0,0 +1,96 @@
+"""Pluggable image decoders.
+
+Every decoder turns the encoded bytes of an image file into a uint8 numpy array with exactly the
+requested channels: (H, W, 3) for mode 'RGB' and (H, W) for mode 'L'. Decoding straight into the
+target mode avoids e.g. decoding a grayscale target to RGB only to convert it back to one channel.
+Backends:
+    pil       -- Pillow (default). Bit-identical to Image.open(path).convert(mode).
+    pil_draft -- Pillow; color JPEG files are draft-decoded straight to 'L' by libjpeg, which uses the
+                 luma channel instead of Pillow's RGB->L formula and may differ by one gray level.
+    cv2       -- OpenCV, if installed. Grayscale conversion may differ from Pillow by one gray level.
+    turbojpeg -- libjpeg-turbo through PyTurboJPEG, if installed; non-JPEG files fall back to Pillow.
+Use 'python -m util.benchmark_decoders --dataroot /path/to/data' to compare them on your data.
+"""
+import io
+import numpy as np
+from PIL import Image
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+try:
+    import turbojpeg
+except ImportError:
+    turbojpeg = None
+
+
+def is_jpeg(data):
+    return data[:2] == b'\xff\xd8'
+
+
+def decode_pil(data, mode):
+    return np.asarray(Image.open(io.BytesIO(data)).convert(mode))
+
+
+def decode_pil_draft(data, mode):
+    img = Image.open(io.BytesIO(data))
+    if img.format == 'JPEG':
+        img.draft(mode, img.size)  # let libjpeg do the color conversion while decoding
+    return np.asarray(img.convert(mode))
+
+
+def decode_cv2(data, mode):
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if mode == 'L':
+        return cv2.imdecode(buf, cv2.IMREAD_GRAYSCALE)
+    return cv2.cvtColor(cv2.imdecode(buf, cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+
+
+_turbojpeg = None
+
+
+def decode_turbojpeg(data, mode):
+    global _turbojpeg
+    if not is_jpeg(data):
+        return decode_pil(data, mode)
+    if _turbojpeg is None:
+        _turbojpeg = turbojpeg.TurboJPEG()
+    if mode == 'L':
+        return _turbojpeg.decode(data, pixel_format=turbojpeg.TJPF_GRAY)[:, :, 0]
+    return _turbojpeg.decode(data, pixel_format=turbojpeg.TJPF_RGB)
+
+
+DECODERS = {'pil': (decode_pil, True),
+            'pil_draft': (decode_pil_draft, True),
+            'cv2': (decode_cv2, cv2 is not None),
+            'turbojpeg': (decode_turbojpeg, turbojpeg is not None)}
+
+
+def available_decoders():
+    """Return the names of the decoders whose backend is installed."""
+    return [name for name, (_, available) in DECODERS.items() if available]
+
+
+def get_decoder(name):
+    """Return the decode(data, mode) function of decoder <name>."""
+    if name not in DECODERS:
+        raise NotImplementedError('decoder [%s] is not found' % name)
+    decoder, available = DECODERS[name]
+    if not available:
+        raise ImportError('the package of decoder [%s] is not installed' % name)
+    return decoder
+
+
+def load_image(path, mode, decoder='pil'):
+    """Decode the image file <path> into a uint8 array of mode 'RGB' or 'L' with decoder <decoder>."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    return get_decoder(decoder)(data, mode)
+
+
+def read_size(path):
+    """Return the (height, width) of the image file <path>, reading only its header."""
+    with Image.open(path) as img:
+        return img.size[1], img.size[0]
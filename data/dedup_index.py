@@ -0,0 +1,111 @@
+"""A perceptual-hash index of near-duplicate tiles.
+
+Overlapping tiles cut from the same slide are often nearly identical. For every image of one
+phase/domain, '[dataroot]/[phase][domain].dedup.json' stores a 64-bit difference hash (dHash) and
+the cluster it belongs to: tiles whose hashes differ in at most '--max_distance' bits are linked,
+and clusters are the connected groups of linked tiles. The index also lists one representative
+per cluster, i.e. the filtered manifest. Samples are keyed by their path relative to the dataroot,
+so the index stays valid however '--dataroot' is spelled. UnalignedDataset uses it ('--dedup') to train on the
+representatives only or to weight every tile by 1 / (size of its cluster).
+
+Use 'python -m util.build_dedup_index --dataroot /path/to/data' to build the index.
+"""
+import os
+import json
+import numpy as np
+from PIL import Image
+from data.manifest import Manifest
+from data.decoders import load_image
+
+DEDUP_VERSION = 2
+
+
+def dedup_index_path(dataroot, phase, domain):
+    return os.path.join(dataroot, phase + domain + '.dedup.json')
+
+
+def dhash(img, hash_size=8):
+    """Return the difference hash of a uint8 grayscale array: one bit per horizontally adjacent pixel pair
+    of the image shrunk to (hash_size + 1) x hash_size, set where the left pixel is brighter.
+    """
+    small = np.asarray(Image.fromarray(img).resize((hash_size + 1, hash_size), Image.BICUBIC), dtype=np.int16)
+    bits = (small[:, :-1] > small[:, 1:]).flatten()
+    return int(sum(1 << i for i, bit in enumerate(bits) if bit))
+
+
+def cluster_hashes(hashes, max_distance):
+    """Return the cluster id of every hash; hashes within <max_distance> bits end up in the same cluster.
+    Candidate pairs are found by splitting the 64 bits into max_distance + 1 bands: two hashes within
+    <max_distance> bits agree in at least one band, so only hashes that share a band value are compared.
+    """
+    parent = list(range(len(hashes)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    n_bands = max_distance + 1
+    bounds = [64 * b // n_bands for b in range(n_bands + 1)]
+    for low, high in zip(bounds[:-1], bounds[1:]):
+        mask = (1 << (high - low)) - 1
+        buckets = {}
+        for i, h in enumerate(hashes):
+            buckets.setdefault((h >> low) & mask, []).append(i)
+        for members in buckets.values():
+            for a in range(len(members)):
+                for b in range(a + 1, len(members)):
+                    i, j = members[a], members[b]
+                    if find(i) != find(j) and bin(hashes[i] ^ hashes[j]).count('1') <= max_distance:
+                        parent[find(i)] = find(j)
+    roots = {}
+    return [roots.setdefault(find(i), len(roots)) for i in range(len(hashes))]
+
+
+def build_dedup_index(dataroot, phase, domain, manifest=None, max_distance=6, decoder='pil'):
+    """Hash every image of one domain, cluster the near-duplicates and write the index next to the dataset.
+
+    Parameters:
+        dataroot (str)      -- path to the dataset root
+        phase (str)         -- train, test, etc
+        domain (str)        -- A or B
+        manifest (Manifest) -- file manifest of <phase>; a new one is loaded and saved if not given
+        max_distance (int)  -- maximum number of differing hash bits of two near-duplicates
+        decoder (str)       -- image decoder, see data/decoders.py
+
+    Returns the number of images and the number of clusters.
+    """
+    if manifest is None:
+        manifest = Manifest(dataroot, phase)
+        img_paths = manifest.paired(domain)[0]
+        manifest.save()
+    else:
+        img_paths = manifest.paired(domain)[0]
+    hashes = [dhash(load_image(path, 'L', decoder)) for path in img_paths]
+    clusters = cluster_hashes(hashes, max_distance)
+    rel_paths = [os.path.relpath(path, dataroot) for path in img_paths]
+    representatives = {}
+    for path, cluster in zip(rel_paths, clusters):
+        representatives.setdefault(cluster, path)
+    samples = {path: {'hash': '%016x' % h, 'cluster': c} for path, h, c in zip(rel_paths, hashes, clusters)}
+    with open(dedup_index_path(dataroot, phase, domain), 'w') as f:
+        json.dump({'version': DEDUP_VERSION, 'max_distance': max_distance, 'samples': samples,
+                   'representatives': [representatives[c] for c in sorted(representatives)]}, f)
+    return len(img_paths), len(representatives)
+
+
+def load_clusters(dataroot, phase, domain, img_paths):
+    """Return the cluster id of every path of <img_paths>, in the same order."""
+    path = dedup_index_path(dataroot, phase, domain)
+    assert os.path.isfile(path), '%s is not a valid dedup index; run "python -m util.build_dedup_index" first' % path
+    with open(path) as f:
+        index = json.load(f)
+    if index.get('version') != DEDUP_VERSION:
+        raise RuntimeError('dedup index %s has version %s, expected %d; re-run "python -m util.build_dedup_index"' % (path, index.get('version'), DEDUP_VERSION))
+    samples = index['samples']
+    img_paths = [os.path.relpath(p, dataroot) for p in img_paths]
+    missing = [p for p in img_paths if p not in samples]
+    if missing:
+        raise RuntimeError('%d images, e.g. %s, are missing from %s; re-run "python -m util.build_dedup_index"' % (len(missing), missing[0], path))
+    return [samples[p]['cluster'] for p in img_paths]
@@ -6,6 +6,7 @@ so that this class can load images from both current directory and its subdirect
 import torch.utils.data as data
 
 from PIL import Image
+from data.decoders import load_image
 import os
 
 IMG_EXTENSIONS = [
@@ -31,8 +32,8 @@ def make_dataset(dir, max_dataset_size=float("inf")):
     return images[:min(max_dataset_size, len(images))]
 
 
-def default_loader(path):
-    return Image.open(path).convert('RGB')
+def default_loader(path, decoder='pil'):
+    return Image.fromarray(load_image(path, 'RGB', decoder))
 
 
 class ImageFolder(data.Dataset):
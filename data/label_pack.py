@@ -0,0 +1,135 @@
+"""A compact on-disk format for the cell and layer label masks.
+
+The labels only hold a handful of distinct gray values, so every mask is stored as indices into
+its own small palette: 1 bit per pixel for binary masks (the '_cell' nuclei), 4 bits per pixel for
+up to 16 values (the '_layer' skin layers) and 8 bits otherwise. All masks of one label directory
+are concatenated into '/path/to/data/trainA_cell.labels' with a JSON index
+'/path/to/data/trainA_cell.labels.json' that keeps the offset, size, palette and paths of every mask;
+the paths are relative to the dataroot, so the packs survive a moved or differently spelled '--dataroot'.
+The packing is lossless; the unpacked masks are identical to Image.open(path).convert('L').
+
+Use 'python -m util.pack_labels --dataroot /path/to/data' to build the label packs.
+"""
+import os
+import json
+import numpy as np
+from PIL import Image
+from data.manifest import Manifest
+
+LABEL_PACK_VERSION = 2
+
+
+def label_pack_paths(dataroot, dir_name):
+    """Return the (data file, index file) paths of the label pack of '[dataroot]/[dir_name]', e.g. 'trainA_cell'."""
+    base = os.path.join(dataroot, dir_name)
+    return base + '.labels', base + '.labels.json'
+
+
+def pack_label(mask):
+    """Return (palette, bits, packed uint8 array) of a 2D uint8 mask."""
+    palette, idx = np.unique(mask, return_inverse=True)
+    idx = idx.astype(np.uint8).reshape(-1)
+    if len(palette) <= 2:
+        return palette, 1, np.packbits(idx)
+    if len(palette) <= 16:
+        if len(idx) % 2:
+            idx = np.append(idx, np.uint8(0))
+        return palette, 4, (idx[0::2] << 4) | idx[1::2]
+    return palette, 8, idx
+
+
+def unpack_label(buf, palette, bits, h, w):
+    """Return the 2D uint8 mask of size (h, w) stored in the packed array <buf>."""
+    n = h * w
+    if bits == 1:
+        idx = np.unpackbits(buf, count=n)
+    elif bits == 4:
+        idx = np.empty(len(buf) * 2, dtype=np.uint8)
+        idx[0::2] = buf >> 4
+        idx[1::2] = buf & 15
+        idx = idx[:n]
+    else:
+        idx = buf[:n]
+    return palette[idx].reshape(h, w)
+
+
+def pack_labels(dataroot, phase, domain, max_dataset_size=float("inf"), manifest=None):
+    """Pack the '_cell' and '_layer' masks of one domain, in the order of the file manifest.
+
+    Parameters:
+        dataroot (str)         -- path to the dataset root
+        phase (str)            -- train, test, etc
+        domain (str)           -- A or B
+        max_dataset_size (int) -- maximum number of masks to pack
+        manifest (Manifest)    -- file manifest of <phase>; a new one is loaded and saved if not given
+
+    Returns the number of packed samples and the packed size in bytes.
+    """
+    if manifest is None:
+        manifest = Manifest(dataroot, phase)
+        img_paths, cell_paths, layer_paths = manifest.paired(domain, max_dataset_size)
+        manifest.save()
+    else:
+        img_paths, cell_paths, layer_paths = manifest.paired(domain, max_dataset_size)
+
+    total = 0
+    for suffix, label_paths in [('_cell', cell_paths), ('_layer', layer_paths)]:
+        data_path, index_path = label_pack_paths(dataroot, phase + domain + suffix)
+        records = []
+        offset = 0
+        with open(data_path + '.tmp', 'wb') as f:
+            for img_path, label_path in zip(img_paths, label_paths):
+                mask = np.asarray(Image.open(label_path).convert('L'))
+                palette, bits, buf = pack_label(mask)
+                f.write(buf.tobytes())
+                records.append({'path': os.path.relpath(label_path, dataroot), 'image_path': os.path.relpath(img_path, dataroot), 'offset': offset, 'nbytes': len(buf),
+                                'height': mask.shape[0], 'width': mask.shape[1], 'bits': bits, 'palette': palette.tolist()})
+                offset += len(buf)
+        os.replace(data_path + '.tmp', data_path)
+        with open(index_path, 'w') as f:
+            json.dump({'version': LABEL_PACK_VERSION, 'samples': records}, f)
+        total += offset
+    return len(img_paths), total
+
+
+class LabelPackReader():
+    """Read the masks of one packed label directory from a memory-mapped file."""
+
+    def __init__(self, dataroot, dir_name, max_dataset_size=float("inf")):
+        """Load the label pack index; the data file itself is mapped lazily.
+
+        Parameters:
+            dataroot (str)         -- path to the dataset root
+            dir_name (str)         -- name of the label directory, e.g. 'trainA_cell'
+            max_dataset_size (int) -- maximum number of masks to expose
+        """
+        self.data_path, index_path = label_pack_paths(dataroot, dir_name)
+        assert os.path.isfile(index_path), '%s is not a valid label pack index; run "python -m util.pack_labels" first' % index_path
+        with open(index_path) as f:
+            index = json.load(f)
+        if index.get('version') != LABEL_PACK_VERSION:
+            raise RuntimeError('label pack %s has version %s, expected %d; re-run "python -m util.pack_labels"' % (index_path, index.get('version'), LABEL_PACK_VERSION))
+        samples = index['samples']
+        self.records = samples[:min(max_dataset_size, len(samples))]
+        self.palettes = [np.array(r['palette'], dtype=np.uint8) for r in self.records]
+        self._buffer = None  # mapped on first access so every DataLoader worker owns its own mapping
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_buffer'] = None  # never pickle the mapping into worker processes
+        return state
+
+    def image_paths(self):
+        """Return the paths, relative to the dataroot, of the images the masks belong to, in pack order."""
+        return [r['image_path'] for r in self.records]
+
+    def read(self, index):
+        """Return the uint8 mask of sample <index>."""
+        if self._buffer is None:
+            self._buffer = np.memmap(self.data_path, dtype=np.uint8, mode='r')
+        r = self.records[index]
+        buf = self._buffer[r['offset']:r['offset'] + r['nbytes']]
+        return unpack_label(buf, self.palettes[index], r['bits'], r['height'], r['width'])
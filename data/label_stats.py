@@ -0,0 +1,74 @@
+"""A precomputed statistics index of the cell and layer labels.
+
+For every image of one phase/domain, '[dataroot]/[phase][domain].labelstats.json' stores the
+foreground fraction of its '_cell' mask and the set, minimum and maximum of the values of its
+'_layer' mask. UnalignedDataset uses it ('--label_stats') to skip or down-weight tiles without
+nuclei and with a single layer, and to hand the per-sample layer range to the model instead of
+recomputing it on the device every step. The statistics describe the whole label file and are keyed
+by the path of the image relative to the dataroot.
+
+Use 'python -m util.build_label_stats --dataroot /path/to/data' to build the index.
+"""
+import os
+import json
+import numpy as np
+from data.manifest import Manifest
+from data.decoders import load_image
+
+LABEL_STATS_VERSION = 2
+
+
+def label_stats_path(dataroot, phase, domain):
+    return os.path.join(dataroot, phase + domain + '.labelstats.json')
+
+
+def build_label_stats(dataroot, phase, domain, manifest=None, decoder='pil'):
+    """Compute the label statistics of every image of one domain and write them next to the dataset.
+
+    Parameters:
+        dataroot (str)      -- path to the dataset root
+        phase (str)         -- train, test, etc
+        domain (str)        -- A or B
+        manifest (Manifest) -- file manifest of <phase>; a new one is loaded and saved if not given
+        decoder (str)       -- image decoder, see data/decoders.py
+
+    Returns the number of indexed images.
+    """
+    if manifest is None:
+        manifest = Manifest(dataroot, phase)
+        img_paths, cell_paths, layer_paths = manifest.paired(domain)
+        manifest.save()
+    else:
+        img_paths, cell_paths, layer_paths = manifest.paired(domain)
+    stats = {}
+    for img_path, cell_path, layer_path in zip(img_paths, cell_paths, layer_paths):
+        cell = load_image(cell_path, 'L', decoder)
+        layer = load_image(layer_path, 'L', decoder)
+        values = np.unique(layer)
+        stats[os.path.relpath(img_path, dataroot)] = {'cell_fraction': float(np.count_nonzero(cell)) / cell.size,
+                           'layer_values': values.tolist(),
+                           'layer_min': int(values[0]), 'layer_max': int(values[-1])}
+    with open(label_stats_path(dataroot, phase, domain), 'w') as f:
+        json.dump({'version': LABEL_STATS_VERSION, 'stats': stats}, f)
+    return len(stats)
+
+
+def load_label_stats(dataroot, phase, domain, img_paths):
+    """Return the label statistics of <img_paths>, in the same order."""
+    path = label_stats_path(dataroot, phase, domain)
+    assert os.path.isfile(path), '%s is not a valid label statistics index; run "python -m util.build_label_stats" first' % path
+    with open(path) as f:
+        index = json.load(f)
+    if index.get('version') != LABEL_STATS_VERSION:
+        raise RuntimeError('label statistics %s have version %s, expected %d; re-run "python -m util.build_label_stats"' % (path, index.get('version'), LABEL_STATS_VERSION))
+    stats = index['stats']
+    img_paths = [os.path.relpath(p, dataroot) for p in img_paths]
+    missing = [p for p in img_paths if p not in stats]
+    if missing:
+        raise RuntimeError('%d images, e.g. %s, are missing from %s; re-run "python -m util.build_label_stats"' % (len(missing), missing[0], path))
+    return [stats[p] for p in img_paths]
+
+
+def is_informative(stats, min_cell_fraction):
+    """Return True if a tile shows nuclei or more than one skin layer."""
+    return stats['cell_fraction'] >= min_cell_fraction or len(stats['layer_values']) > 1
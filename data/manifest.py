@@ -0,0 +1,132 @@
+"""A persistent file manifest for the unaligned dataset layout.
+
+Scanning '[phase]A', '[phase]A_cell', '[phase]A_layer', ... with os.walk on every run is slow on
+network filesystems with many tiles. The manifest caches the directory listings of one phase in
+'[manifest_dir]/.manifest_[phase].json'; the dataroot itself is never written to. A directory is
+listed again only when its mtime changed (i.e. files were added or removed), so refreshing after
+new tiles were copied in is incremental. Without a manifest_dir, the listings are not cached.
+Images are paired with their '_cell'/'_layer' labels by relative path without extension
+(a trailing '_cell'/'_layer' in the label file name is ignored), not by position in sorted lists;
+an image without both labels is an error.
+"""
+import os
+import json
+from data.image_folder import is_image_file
+
+MANIFEST_VERSION = 1
+
+
+def _pair_key(path, root, suffix):
+    """Return the key that pairs <path> under <root> with the files of the other directories."""
+    stem = os.path.splitext(os.path.relpath(path, root))[0]
+    if suffix and stem.endswith(suffix):
+        stem = stem[:-len(suffix)]
+    return stem
+
+
+class Manifest():
+    """Cached, validated directory listings of one dataroot/phase."""
+
+    def __init__(self, dataroot, phase, manifest_dir=None, verify=False):
+        """Load the cached manifest if there is one.
+
+        Parameters:
+            dataroot (str)     -- path to the dataset root
+            phase (str)        -- train, test, etc
+            manifest_dir (str) -- where to keep the manifest file; if None, the listings are not cached
+            verify (bool)      -- also check size and mtime of every cached file, not only of its directory
+        """
+        self.dataroot = dataroot
+        self.phase = phase
+        self.verify = verify
+        self.path = os.path.join(manifest_dir, '.manifest_%s.json' % phase) if manifest_dir else None
+        self.trees = {}
+        self.dirty = False
+        if self.path is not None and os.path.isfile(self.path):
+            try:
+                with open(self.path) as f:
+                    cached = json.load(f)
+                if cached.get('version') == MANIFEST_VERSION:
+                    self.trees = cached['trees']
+            except (OSError, ValueError):
+                print('manifest %s is unreadable and will be rebuilt' % self.path)
+
+    def _is_stale(self, path, entry, mtime):
+        """Return True if the cached listing <entry> of directory <path> cannot be reused."""
+        if entry is None or entry['mtime'] != mtime:
+            return True
+        if self.verify:
+            for name, (size, file_mtime) in entry['files'].items():
+                try:
+                    st = os.stat(os.path.join(path, name))
+                except OSError:
+                    return True
+                if st.st_size != size or st.st_mtime_ns != file_mtime:
+                    return True
+        return False
+
+    def list_images(self, dir_name, max_dataset_size=float("inf")):
+        """Return the sorted image paths under '[dataroot]/[dir_name]' (including its subdirectories).
+        The walk stops early once <max_dataset_size> images were found.
+        """
+        root = os.path.join(self.dataroot, dir_name)
+        assert os.path.isdir(root), '%s is not a valid directory' % root
+        cached = self.trees.get(dir_name, {})
+        tree = {}
+        images = []
+        pending = ['']
+        while pending and len(images) < max_dataset_size:
+            rel = pending.pop()
+            path = os.path.join(root, rel)
+            mtime = os.stat(path).st_mtime_ns
+            entry = cached.get(rel)
+            if self._is_stale(path, entry, mtime):
+                files, subdirs = {}, []
+                with os.scandir(path) as it:
+                    for e in it:
+                        if e.is_dir():
+                            subdirs.append(e.name)
+                        elif is_image_file(e.name):
+                            st = e.stat()
+                            files[e.name] = [st.st_size, st.st_mtime_ns]
+                entry = {'mtime': mtime, 'files': files, 'subdirs': sorted(subdirs)}
+                self.dirty = True
+            tree[rel] = entry
+            images += [os.path.join(path, name) for name in sorted(entry['files'])]
+            pending += [os.path.join(rel, d) for d in reversed(entry['subdirs'])]
+        if not pending:  # only complete walks are cached; a truncated walk would hide files
+            if set(tree) != set(cached):
+                self.dirty = True
+            self.trees[dir_name] = tree
+        images = sorted(images)
+        return images[:min(max_dataset_size, len(images))]
+
+    def paired(self, domain, max_dataset_size=float("inf")):
+        """Return the image, cell label and layer label paths of one domain, paired by file name.
+        The first <max_dataset_size> images are paired with the complete label listings, so the limit
+        counts pairs. An image without both labels raises a RuntimeError.
+        """
+        dir_name = self.phase + domain
+        img_paths = self.list_images(dir_name, max_dataset_size)
+        labels = []
+        for suffix in ['_cell', '_layer']:
+            root = os.path.join(self.dataroot, dir_name + suffix)
+            labels.append({_pair_key(p, root, suffix): p for p in self.list_images(dir_name + suffix)})
+        root = os.path.join(self.dataroot, dir_name)
+        keys = [_pair_key(p, root, '') for p in img_paths]
+        missing = [p for p, key in zip(img_paths, keys) if key not in labels[0] or key not in labels[1]]
+        if missing:
+            raise RuntimeError('%d images in %s, e.g. %s, have no _cell/_layer label of the same name' % (len(missing), root, missing[0]))
+        return img_paths, [labels[0][key] for key in keys], [labels[1][key] for key in keys]
+
+    def save(self):
+        """Write the manifest back if anything changed. A read-only manifest_dir is not an error."""
+        if self.path is None or not self.dirty:
+            return
+        try:
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump({'version': MANIFEST_VERSION, 'trees': self.trees}, f)
+            os.replace(self.path + '.tmp', self.path)
+            self.dirty = False
+        except OSError as e:
+            print('could not write manifest %s: %s' % (self.path, e))
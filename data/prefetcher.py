@@ -0,0 +1,91 @@
+"""A background prefetcher that moves the next batches to the device while the current step runs.
+
+A thread pulls batches from the DataLoader, copies their tensors to the device (on a side CUDA
+stream when a GPU is used) and normalizes uint8 batches ('--uint8_batches') there. The training
+loop then receives batches whose tensors are already resident, so <set_input> has nothing left to
+copy. On CPU-only hosts the thread still overlaps loading, collation and dtype conversion with
+the training step.
+"""
+import queue
+import threading
+import torch
+from data.base_dataset import normalize_batch
+
+_END = object()
+
+
+class DevicePrefetcher():
+    """Wrap an iterable of batch dictionaries and prefetch up to <depth> batches onto <device>."""
+
+    def __init__(self, loader, device, depth=2, keep_uint8=()):
+        """Initialize the prefetcher.
+
+        Parameters:
+            loader (iterable)     -- yields batch dictionaries, e.g. a torch DataLoader
+            device (torch.device) -- the device the model runs on
+            depth (int)           -- maximum number of batches prepared ahead of the consumer
+            keep_uint8 (list)     -- keys of uint8 tensors that are moved but not normalized, e.g. '--compact_labels'
+        """
+        self.loader = loader
+        self.device = device
+        self.depth = depth
+        self.keep_uint8 = set(keep_uint8)
+
+    def _move(self, batch):
+        """Copy every tensor of <batch> to the device; uint8 images are normalized to [-1, 1] there."""
+        moved = {}
+        for key, value in batch.items():
+            if isinstance(value, torch.Tensor):
+                value = value.to(self.device, non_blocking=True)
+                if value.dtype == torch.uint8 and key not in self.keep_uint8:
+                    value = normalize_batch(value)
+            moved[key] = value
+        return moved
+
+    def _produce(self, batches, stop):
+        stream = torch.cuda.Stream(self.device) if self.device.type == 'cuda' else None
+        try:
+            for batch in self.loader:
+                if stop.is_set():
+                    return
+                event = None
+                if stream is not None:
+                    with torch.cuda.stream(stream):
+                        batch = self._move(batch)
+                        event = torch.cuda.Event()
+                        event.record(stream)
+                else:
+                    batch = self._move(batch)
+                batches.put((batch, event))
+        except Exception as e:  # re-raised in the consumer thread
+            batches.put(e)
+            return
+        batches.put(_END)
+
+    def __iter__(self):
+        batches = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._produce, args=(batches, stop), daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = batches.get()
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                batch, event = item
+                if event is not None:  # wait for the copy and keep the memory alive on the compute stream
+                    current = torch.cuda.current_stream(self.device)
+                    current.wait_event(event)
+                    for value in batch.values():
+                        if isinstance(value, torch.Tensor):
+                            value.record_stream(current)
+                yield batch
+        finally:  # the consumer stopped early: unblock the producer and let it finish
+            stop.set()
+            while thread.is_alive():
+                try:
+                    batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
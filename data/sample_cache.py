@@ -0,0 +1,103 @@
+"""A decoded-sample cache in shared memory, visible to all DataLoader workers.
+
+The cache is created in the main process before the workers are started, so every worker maps
+the same region. A sample is stored as the uint8 bytes of its image (H x W x C) followed by its cell and
+layer masks (H x W each), the same layout as a packed shard (see data/shard_store.py).
+The region is split into equally sized slots (sized after the first cached sample); slots are
+recycled with the CLOCK (second-chance) policy once the byte budget is used up.
+"""
+import multiprocessing
+import torch
+
+# positions in the shared header
+_SLOT_BYTES, _N_SLOTS, _HAND, _HITS, _MISSES, _EVICTIONS = range(6)
+
+
+def img_shape(h, w, c):
+    """Return the array shape of an image with <c> channels; grayscale images are 2D."""
+    return (h, w) if c == 1 else (h, w, c)
+
+
+class SharedSampleCache():
+    """CLOCK-evicted cache of decoded (image, cell, layer) samples shared between processes."""
+
+    def __init__(self, n_keys, budget_bytes):
+        """Allocate the shared region and its slot table.
+
+        Parameters:
+            n_keys (int)       -- number of distinct samples that can be cached (keys are 0 .. n_keys - 1)
+            budget_bytes (int) -- size of the shared data region in bytes
+        """
+        self.budget_bytes = int(budget_bytes)
+        self.header = torch.zeros(6, dtype=torch.int64).share_memory_()
+        self.data = torch.empty(self.budget_bytes, dtype=torch.uint8).share_memory_()
+        self.where = torch.full((n_keys,), -1, dtype=torch.int64).share_memory_()     # key -> slot
+        self.slot_key = torch.full((n_keys,), -1, dtype=torch.int64).share_memory_()  # slot -> key
+        self.slot_shape = torch.zeros(n_keys, 3, dtype=torch.int64).share_memory_()    # (H, W, C) of the image
+        self.slot_ref = torch.zeros(n_keys, dtype=torch.uint8).share_memory_()         # CLOCK reference bits
+        self.lock = multiprocessing.Lock()
+
+    def get(self, key):
+        """Return a copy of the cached (image, cell, layer) arrays of <key>, or None on a miss."""
+        with self.lock:
+            slot = int(self.where[key])
+            if slot < 0:
+                self.header[_MISSES] += 1
+                return None
+            self.header[_HITS] += 1
+            self.slot_ref[slot] = 1
+            h, w, c = self.slot_shape[slot].tolist()
+            start = slot * int(self.header[_SLOT_BYTES])
+            buf = self.data[start:start + h * w * (c + 2)].numpy().copy()
+        img = buf[:h * w * c].reshape(img_shape(h, w, c))
+        cell = buf[h * w * c:h * w * (c + 1)].reshape(h, w)
+        layer = buf[h * w * (c + 1):].reshape(h, w)
+        return img, cell, layer
+
+    def put(self, key, img, cell, layer):
+        """Store the uint8 arrays of <key>, evicting another sample if the cache is full.
+        Samples larger than the slot size are not cached.
+        """
+        h, w = cell.shape
+        c = img.shape[2] if img.ndim == 3 else 1
+        nbytes = h * w * (c + 2)
+        with self.lock:
+            if int(self.where[key]) >= 0:  # another worker was faster
+                return
+            if self.header[_SLOT_BYTES] == 0:  # the first sample decides the slot size: an RGB image and both masks
+                self.header[_SLOT_BYTES] = h * w * 5
+                self.header[_N_SLOTS] = min(self.budget_bytes // (h * w * 5), len(self.where))
+            slot_bytes, n_slots = int(self.header[_SLOT_BYTES]), int(self.header[_N_SLOTS])
+            if nbytes > slot_bytes or n_slots == 0:
+                return
+            hand = int(self.header[_HAND])
+            while True:
+                slot = hand
+                hand = (hand + 1) % n_slots
+                old_key = int(self.slot_key[slot])
+                if old_key < 0:
+                    break
+                if self.slot_ref[slot]:  # recently used: give it a second chance
+                    self.slot_ref[slot] = 0
+                    continue
+                self.where[old_key] = -1
+                self.header[_EVICTIONS] += 1
+                break
+            self.header[_HAND] = hand
+            start = slot * slot_bytes
+            dst = self.data[start:start + nbytes].numpy()
+            dst[:h * w * c] = img.reshape(-1)
+            dst[h * w * c:h * w * (c + 1)] = cell.reshape(-1)
+            dst[h * w * (c + 1):] = layer.reshape(-1)
+            self.slot_key[slot] = key
+            self.slot_shape[slot] = torch.tensor([h, w, c])
+            self.slot_ref[slot] = 1
+            self.where[key] = slot
+
+    def stats(self):
+        """Return the hit/miss/eviction counters and the number of cached samples."""
+        hits, misses = int(self.header[_HITS]), int(self.header[_MISSES])
+        return {'hits': hits, 'misses': misses,
+                'hit_rate': hits / max(hits + misses, 1),
+                'evictions': int(self.header[_EVICTIONS]),
+                'cached': int((self.slot_key >= 0).sum())}
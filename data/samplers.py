@@ -0,0 +1,80 @@
+"""Samplers used by CustomDatasetDataLoader in addition to the default sequential/random ones."""
+import random
+import torch
+import torch.utils.data
+
+
+class InfiniteSampler(torch.utils.data.Sampler):
+    """Yield dataset indices forever, one shuffled (or ordered) pass after the other.
+
+    Every pass is shuffled with a generator seeded by <seed> + pass number, so the stream of
+    indices only depends on <seed> and a run can be resumed at the first batch of an epoch with <start>.
+    """
+
+    def __init__(self, size, shuffle=True, seed=0, start=0, weights=None):
+        """Initialize the sampler.
+
+        Parameters:
+            size (int)     -- number of samples in one pass
+            shuffle (bool) -- shuffle every pass; otherwise yield 0, 1, ..., size - 1 again and again
+            seed (int)     -- seed of the per-pass permutations
+            start (int)    -- number of indices to skip, i.e. the position to resume from
+            weights (list) -- if given, every pass draws <size> indices with replacement with these weights
+        """
+        self.size = size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.start = start
+        self.weights = None if weights is None else torch.as_tensor(weights, dtype=torch.double)
+
+    def __iter__(self):
+        position = self.start
+        while True:
+            n_pass, offset = divmod(position, self.size)
+            generator = torch.Generator()
+            generator.manual_seed(self.seed + n_pass)
+            if self.weights is not None:
+                order = torch.multinomial(self.weights, self.size, replacement=True, generator=generator).tolist()
+            elif self.shuffle:
+                order = torch.randperm(self.size, generator=generator).tolist()
+            else:
+                order = list(range(self.size))
+            for index in order[offset:]:
+                yield index
+            position = (n_pass + 1) * self.size
+
+
+class BucketBatchSampler(torch.utils.data.Sampler):
+    """Yield batches of dataset indices whose samples have the same (height, width).
+
+    Every epoch, the indices of each size bucket are shuffled and cut into batches, and the order of
+    all batches is shuffled, so only the last batch of a bucket can be smaller than <batch_size>.
+    """
+
+    def __init__(self, sizes, batch_size, shuffle=True):
+        """Initialize the sampler.
+
+        Parameters:
+            sizes (list)     -- the (height, width) of every dataset index
+            batch_size (int) -- maximum number of samples per batch
+            shuffle (bool)   -- shuffle within buckets and the order of the batches
+        """
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.buckets = {}
+        for index, size in enumerate(sizes):
+            self.buckets.setdefault(tuple(size), []).append(index)
+
+    def __iter__(self):
+        batches = []
+        for indices in self.buckets.values():
+            indices = list(indices)
+            if self.shuffle:
+                random.shuffle(indices)
+            batches += [indices[i:i + self.batch_size] for i in range(0, len(indices), self.batch_size)]
+        if self.shuffle:
+            random.shuffle(batches)
+        return iter(batches)
+
+    def __len__(self):
+        return sum(-(-len(indices) // self.batch_size) for indices in self.buckets.values())
@@ -0,0 +1,66 @@
+from data.base_dataset import BaseDataset, get_transform
+from data.shard_store import ShardReader
+from PIL import Image
+import random
+
+
+class ShardDataset(BaseDataset):
+    """
+    This dataset class loads the same unaligned data as 'unaligned', but from packed shards.
+    Each phase/domain is a single memory-mapped file '/path/to/data/trainA.shard' that holds the
+    decoded images together with their cell and layer labels, so a sample is read as a slice
+    instead of six file opens and six PNG decodes.
+    Build the shards once with 'python -m util.pack_shards --dataroot /path/to/data'.
+    """
+
+    def __init__(self, opt):
+        """Initialize this dataset class.
+        Parameters:
+            opt (Option class) -- stores all the experiment flags; needs to be a subclass of BaseOptions
+        """
+        BaseDataset.__init__(self, opt)
+        self.shard_A = ShardReader(opt.dataroot, opt.phase, 'A', opt.max_dataset_size)
+        self.shard_B = ShardReader(opt.dataroot, opt.phase, 'B', opt.max_dataset_size)
+        self.A_size = len(self.shard_A)  # get the size of dataset A
+        self.B_size = len(self.shard_B)  # get the size of dataset B
+
+        self.transform_img = get_transform(self.opt, grayscale=False)
+        self.transform_gt = get_transform(self.opt, grayscale=True)
+        self.transform_label = get_transform(self.opt, grayscale=True, label=True)
+
+    def __getitem__(self, index):
+        """Return a data point and its metadata information.
+        Parameters:
+            index (int)      -- a random integer for data indexing
+        Returns the same dictionary as UnalignedDataset.
+        """
+        if self.opt.serial_batches:   # make sure index is within then range
+            index_B = index % self.B_size
+        else:   # randomize the index for domain B to avoid fixed pairs.
+            index_B = random.randint(0, self.B_size - 1)
+        A_img, gt_A_cell_img, gt_A_line_img, A_record = self.shard_A.read(index % self.A_size)
+        B_img, gt_B_cell_img, gt_B_line_img, B_record = self.shard_B.read(index_B)
+
+        # apply image transformation
+        A = self.transform_img(Image.fromarray(A_img))
+        B = self.transform_gt(Image.fromarray(B_img))
+        A_gt_cell = self.transform_label(Image.fromarray(gt_A_cell_img))
+        B_gt_cell = self.transform_label(Image.fromarray(gt_B_cell_img))
+        A_gt_line = self.transform_label(Image.fromarray(gt_A_line_img))
+        B_gt_line = self.transform_label(Image.fromarray(gt_B_line_img))
+
+        return {'A': A, 'B': B,
+                'A_gt_cell': A_gt_cell, 'B_gt_cell': B_gt_cell,
+                'A_gt_line': A_gt_line, 'B_gt_line': B_gt_line,
+                'A_paths': A_record['path'], 'B_paths': B_record['path'],
+                'gt_A_cell_path': A_record['cell_path'], 'gt_B_cell_path': B_record['cell_path'],
+                'gt_A_line_path': A_record['layer_path'], 'gt_B_line_path': B_record['layer_path']}
+
+    def sample_sizes(self):
+        """Return the (height, width) of image A of every data point, read from the shard index."""
+        records = self.shard_A.records
+        return [(records[i % self.A_size]['height'], records[i % self.A_size]['width']) for i in range(len(self))]
+
+    def __len__(self):
+        """Return the total number of images in the dataset."""
+        return max(self.A_size, self.B_size)
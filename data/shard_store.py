@@ -0,0 +1,110 @@
+"""Packed, memory-mapped shard store for the unaligned dataset layout.
+
+A shard packs one domain of one phase (e.g. '/path/to/data/trainA' together with
+'trainA_cell' and 'trainA_layer') into a single uint8 file '/path/to/data/trainA.shard'.
+Every sample is stored as its decoded RGB image (H x W x 3) followed by its cell and
+layer masks (H x W each). A JSON index '/path/to/data/trainA.shard.json' keeps the byte
+offset, size and original paths of every sample, in the same sorted order and with the same
+image/label pairing as the file manifest used by '--dataset_mode unaligned' (see data/manifest.py).
+
+Use 'python -m util.pack_shards --dataroot /path/to/data' to build the shards.
+"""
+import os
+import json
+import numpy as np
+from PIL import Image
+from data.manifest import Manifest
+
+SHARD_VERSION = 1
+
+
+def shard_paths(dataroot, phase, domain):
+    """Return the (data file, index file) paths of the shard for <phase><domain>, e.g. 'trainA'."""
+    base = os.path.join(dataroot, phase + domain)
+    return base + '.shard', base + '.shard.json'
+
+
+def pack_domain(dataroot, phase, domain, max_dataset_size=float("inf"), manifest=None):
+    """Pack the images and the cell/layer labels of one domain into a single shard.
+
+    Parameters:
+        dataroot (str)         -- path to the dataset root that contains [phase][domain], [phase][domain]_cell, ...
+        phase (str)            -- train, test, etc
+        domain (str)           -- A or B
+        max_dataset_size (int) -- maximum number of samples to pack
+        manifest (Manifest)    -- file manifest of <phase>; a new one is loaded and saved if not given
+
+    Returns the number of packed samples.
+    """
+    if manifest is None:
+        manifest = Manifest(dataroot, phase)
+        img_paths, cell_paths, layer_paths = manifest.paired(domain, max_dataset_size)
+        manifest.save()
+    else:
+        img_paths, cell_paths, layer_paths = manifest.paired(domain, max_dataset_size)
+
+    data_path, index_path = shard_paths(dataroot, phase, domain)
+    records = []
+    offset = 0
+    with open(data_path + '.tmp', 'wb') as f:
+        for img_path, cell_path, layer_path in zip(img_paths, cell_paths, layer_paths):
+            img = np.asarray(Image.open(img_path).convert('RGB'))
+            cell = np.asarray(Image.open(cell_path).convert('L'))
+            layer = np.asarray(Image.open(layer_path).convert('L'))
+            h, w = cell.shape
+            assert img.shape[:2] == cell.shape == layer.shape, 'size mismatch between %s and its labels' % img_path
+            for arr in (img, cell, layer):
+                f.write(np.ascontiguousarray(arr).tobytes())
+            records.append({'path': img_path, 'cell_path': cell_path, 'layer_path': layer_path,
+                            'offset': offset, 'height': h, 'width': w})
+            offset += h * w * 5
+    os.replace(data_path + '.tmp', data_path)
+    with open(index_path, 'w') as f:
+        json.dump({'version': SHARD_VERSION, 'samples': records}, f)
+    return len(records)
+
+
+class ShardReader():
+    """Read samples of one packed domain as zero-copy slices of a memory-mapped file."""
+
+    def __init__(self, dataroot, phase, domain, max_dataset_size=float("inf")):
+        """Load the shard index; the data file itself is mapped lazily.
+
+        Parameters:
+            dataroot (str)         -- path to the dataset root
+            phase (str)            -- train, test, etc
+            domain (str)           -- A or B
+            max_dataset_size (int) -- maximum number of samples to expose
+        """
+        self.data_path, index_path = shard_paths(dataroot, phase, domain)
+        assert os.path.isfile(index_path), '%s is not a valid shard index; run "python -m util.pack_shards" first' % index_path
+        with open(index_path) as f:
+            index = json.load(f)
+        if index.get('version') != SHARD_VERSION:
+            raise RuntimeError('shard %s has version %s, expected %d; re-run "python -m util.pack_shards"' % (index_path, index.get('version'), SHARD_VERSION))
+        samples = index['samples']
+        self.records = samples[:min(max_dataset_size, len(samples))]
+        self._buffer = None  # mapped on first access so every DataLoader worker owns its own mapping
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_buffer'] = None  # never pickle the mapping into worker processes
+        return state
+
+    def read(self, index):
+        """Return (image, cell, layer) uint8 arrays and the record of sample <index>.
+        The arrays are read-only views into the mapped shard; nothing is copied or decoded.
+        """
+        if self._buffer is None:
+            self._buffer = np.memmap(self.data_path, dtype=np.uint8, mode='r')
+        record = self.records[index]
+        h, w, offset = record['height'], record['width'], record['offset']
+        img = self._buffer[offset:offset + h * w * 3].reshape(h, w, 3)
+        offset += h * w * 3
+        cell = self._buffer[offset:offset + h * w].reshape(h, w)
+        offset += h * w
+        layer = self._buffer[offset:offset + h * w].reshape(h, w)
+        return img, cell, layer, record
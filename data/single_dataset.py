@@ -1,5 +1,6 @@
 from data.base_dataset import BaseDataset, get_transform
 from data.image_folder import make_dataset
+from data.decoders import load_image, read_size
 from PIL import Image
 
 
@@ -27,10 +28,14 @@ class SingleDataset(BaseDataset):
             A_paths(str) - - the path of the image
         """
         A_path = self.A_paths[index]
-        A_img = Image.open(A_path).convert('RGB')
+        A_img = Image.fromarray(load_image(A_path, 'RGB', self.opt.decoder))
         A = self.transform(A_img)
         return {'A': A, 'A_paths': A_path}
 
+    def sample_sizes(self):
+        """Return the (height, width) of every image, read from the file headers."""
+        return [read_size(path) for path in self.A_paths]
+
     def __len__(self):
         """Return the total number of images in the dataset."""
         return len(self.A_paths)
\ No newline at end of file
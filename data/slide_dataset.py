@@ -0,0 +1,120 @@
+import os
+import bisect
+import random
+from data.base_dataset import BaseDataset, get_transform
+from data.manifest import Manifest
+from data.slide_reader import TiledImageReader, SlideCache
+from PIL import Image
+
+
+class SlideDataset(BaseDataset):
+    """
+    This dataset class serves unaligned '--crop_size' patches straight from large tiled TIFF slides.
+    It uses the same layout as 'unaligned', but every file in '/path/to/data/trainA' (and in trainA_cell,
+    trainA_layer, trainB, ...) is a whole slide or its label raster instead of a pre-cut tile.
+    Only the tiles that intersect a patch are read and decoded (see data/slide_reader.py).
+    One epoch visits every slide of domain A on a grid of crop_size patches; during training every
+    patch is randomly shifted within its grid cell, and the domain B patch is drawn at random.
+    Requires the optional 'tifffile' package.
+    """
+
+    @staticmethod
+    def modify_commandline_options(parser, is_train):
+        """Add new dataset-specific options, and rewrite default values for existing options.
+        Parameters:
+            parser          -- original option parser
+            is_train (bool) -- whether training phase or test phase. You can use this flag to add training-specific or test-specific options.
+        Returns:
+            the modified parser.
+        """
+        parser.add_argument('--slide_level', type=int, default=0, help='pyramid level of the slides to read patches from, 0 is the full resolution')
+        parser.add_argument('--slide_tile_cache', type=int, default=256, help='number of decoded tiles every data loading worker keeps over all slides')
+        parser.add_argument('--slide_open_files', type=int, default=64, help='number of slide files every data loading worker keeps open over all slides')
+        return parser
+
+    def __init__(self, opt):
+        """Initialize this dataset class.
+        Parameters:
+            opt (Option class) -- stores all the experiment flags; needs to be a subclass of BaseOptions
+        """
+        BaseDataset.__init__(self, opt)
+        self.crop_size = opt.crop_size
+        manifest = Manifest(opt.dataroot, opt.phase)
+        self.tile_cache = SlideCache(opt.slide_tile_cache, opt.slide_open_files)  # shared by all readers; every worker gets its own empty copy
+        self.slides = {}
+        self.cum_patches = {}
+        for domain in ['A', 'B']:
+            slides, counts = [], []
+            for paths in zip(*manifest.paired(domain, opt.max_dataset_size)):
+                readers = [TiledImageReader(p, opt.slide_level, self.tile_cache) for p in paths]
+                assert all((r.height, r.width) == (readers[0].height, readers[0].width) for r in readers), \
+                    'the label rasters of %s do not match its size' % paths[0]
+                n = (readers[0].height // self.crop_size) * (readers[0].width // self.crop_size)
+                if n == 0:
+                    print('%s is smaller than crop_size and is skipped' % paths[0])
+                    continue
+                slides.append(readers)
+                counts.append(n)
+            assert len(slides) > 0, 'found no slide of at least crop_size in %s' % os.path.join(opt.dataroot, opt.phase + domain)
+            self.slides[domain] = slides
+            self.cum_patches[domain] = [sum(counts[:i + 1]) for i in range(len(counts))]
+        manifest.save()
+        self.A_size = self.cum_patches['A'][-1]  # number of grid patches of domain A
+        self.B_size = self.cum_patches['B'][-1]  # number of grid patches of domain B
+
+        self.transform_img = get_transform(self.opt, grayscale=False)
+        self.transform_gt = get_transform(self.opt, grayscale=True)
+        self.transform_label = get_transform(self.opt, grayscale=True, label=True)
+
+    def read_patch(self, domain, index, jitter):
+        """Return the image, cell label and layer label of grid patch <index> of <domain>, and their patch names.
+        With <jitter>, the patch is shifted randomly within its grid cell.
+        """
+        cum = self.cum_patches[domain]
+        slide = bisect.bisect_right(cum, index)
+        index -= cum[slide - 1] if slide > 0 else 0
+        img, cell, layer = self.slides[domain][slide]
+        cols = img.width // self.crop_size
+        y, x = (index // cols) * self.crop_size, (index % cols) * self.crop_size
+        if jitter:
+            y = min(y + random.randrange(self.crop_size), img.height - self.crop_size)
+            x = min(x + random.randrange(self.crop_size), img.width - self.crop_size)
+        patch, paths = [], []
+        for r in (img, cell, layer):
+            patch.append(r.read_region(y, x, self.crop_size, self.crop_size))
+            name, ext = os.path.splitext(r.path)
+            paths.append('%s_%d_%d%s' % (name, y, x, ext))  # a unique name for every patch, e.g. for saving test results
+        return patch, paths
+
+    def __getitem__(self, index):
+        """Return a data point and its metadata information.
+        Parameters:
+            index (int)      -- a random integer for data indexing
+        Returns the same dictionary as UnalignedDataset; the paths name the slide and the patch position.
+        """
+        jitter = not self.opt.serial_batches
+        if self.opt.serial_batches:
+            index_B = index % self.B_size
+        else:   # randomize the index for domain B to avoid fixed pairs.
+            index_B = random.randint(0, self.B_size - 1)
+        (A_img, gt_A_cell_img, gt_A_line_img), (A_path, gt_A_cell_path, gt_A_line_path) = self.read_patch('A', index % self.A_size, jitter)
+        (B_img, gt_B_cell_img, gt_B_line_img), (B_path, gt_B_cell_path, gt_B_line_path) = self.read_patch('B', index_B, jitter)
+
+        # apply image transformation
+        A = self.transform_img(Image.fromarray(A_img).convert('RGB'))
+        B = self.transform_gt(Image.fromarray(B_img).convert('RGB'))
+        A_gt_cell = self.transform_label(Image.fromarray(gt_A_cell_img).convert('L'))
+        B_gt_cell = self.transform_label(Image.fromarray(gt_B_cell_img).convert('L'))
+        A_gt_line = self.transform_label(Image.fromarray(gt_A_line_img).convert('L'))
+        B_gt_line = self.transform_label(Image.fromarray(gt_B_line_img).convert('L'))
+
+        return {'A': A, 'B': B,
+                'A_gt_cell': A_gt_cell, 'B_gt_cell': B_gt_cell,
+                'A_gt_line': A_gt_line, 'B_gt_line': B_gt_line,
+                'A_paths': A_path, 'B_paths': B_path,
+                'gt_A_cell_path': gt_A_cell_path, 'gt_B_cell_path': gt_B_cell_path,
+                'gt_A_line_path': gt_A_line_path, 'gt_B_line_path': gt_B_line_path}
+
+    def __len__(self):
+        """Return the number of grid patches of the larger domain."""
+        return max(self.A_size, self.B_size)
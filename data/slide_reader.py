@@ -0,0 +1,137 @@
+"""Lazy region reading from large tiled (and optionally pyramidal) TIFF images.
+
+Only the tiles (or strips) that intersect a requested region are read from disk and decoded.
+All readers of a process share one <SlideCache>: an LRU of the most recently used decoded tiles,
+keyed by (path, level, tile), and a bounded pool of open file handles that are closed on eviction,
+so neither memory nor file descriptors grow with the number of slides.
+Requires the optional 'tifffile' package.
+"""
+import threading
+from collections import OrderedDict
+import numpy as np
+
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+
+class SlideCache():
+    """Decoded tiles and open file handles shared by all TiledImageReaders of one process.
+    A copy sent to a DataLoader worker starts empty, so every worker has its own cache; with
+    '--loader_backend thread', the loading threads share it under a lock.
+    """
+
+    def __init__(self, cache_tiles=256, max_open=64):
+        """Initialize the cache.
+
+        Parameters:
+            cache_tiles (int) -- number of decoded tiles kept in memory, over all slides
+            max_open (int)    -- number of slide files kept open, over all slides
+        """
+        self.cache_tiles = cache_tiles
+        self.max_open = max_open
+        self._reset()
+
+    def _reset(self):
+        self._tiles = OrderedDict()  # (path, level, row, col) -> decoded tile
+        self._files = OrderedDict()  # (path, level) -> (TiffFile, keyframe)
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {'cache_tiles': self.cache_tiles, 'max_open': self.max_open}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def _page(self, reader):
+        """Return the open file and the keyframe of <reader>; called with the lock held."""
+        key = (reader.path, reader.level)
+        if key in self._files:
+            self._files.move_to_end(key)
+            return self._files[key]
+        tif = tifffile.TiffFile(reader.path)
+        self._files[key] = (tif, reader.keyframe(tif))
+        if len(self._files) > self.max_open:
+            _, (old, _) = self._files.popitem(last=False)
+            old.close()
+        return self._files[key]
+
+    def tile(self, reader, row, col):
+        """Return the decoded (h, w, samples) tile of <reader> at grid position (row, col)."""
+        key = (reader.path, reader.level, row, col)
+        with self._lock:
+            if key in self._tiles:
+                self._tiles.move_to_end(key)
+                return self._tiles[key]
+            tif, page = self._page(reader)
+            index = row * reader.tiles_across + col
+            fh = tif.filehandle
+            fh.seek(page.dataoffsets[index])
+            data = fh.read(page.databytecounts[index])
+        segment, _, _ = page.decode(data, index, jpegtables=page.jpegtables)  # decoding needs no file access
+        tile = segment[0, 0]  # (1, depth, length, width, samples) -> (length, width, samples)
+        with self._lock:
+            self._tiles[key] = tile
+            if len(self._tiles) > self.cache_tiles:
+                self._tiles.popitem(last=False)
+        return tile
+
+    def close(self):
+        """Close every open file and drop the cached tiles."""
+        with self._lock:
+            for tif, _ in self._files.values():
+                tif.close()
+            self._files.clear()
+            self._tiles.clear()
+
+
+class TiledImageReader():
+    """Read rectangular regions of one level of a tiled TIFF image."""
+
+    def __init__(self, path, level=0, cache=None):
+        """Read the image geometry; the file is closed again and reopened through <cache> when regions are read.
+
+        Parameters:
+            path (str)          -- path to the TIFF image
+            level (int)         -- pyramid level to read, 0 is the full resolution
+            cache (SlideCache)  -- tile cache and file handle pool, usually shared by all readers; a private one if None
+        """
+        if tifffile is None:
+            raise ImportError('reading whole-slide images requires the tifffile package: pip install tifffile')
+        self.path = path
+        self.level = level
+        self.cache = cache if cache is not None else SlideCache()
+        with tifffile.TiffFile(path) as tif:
+            page = self.keyframe(tif)
+            self.height, self.width = page.imagelength, page.imagewidth
+            self.samples = page.samplesperpixel
+            assert page.dtype == np.uint8, '%s: only 8-bit images are supported, found %s' % (path, page.dtype)
+            if page.is_tiled:
+                self.tile_h, self.tile_w = page.tilelength, page.tilewidth
+            else:  # striped images are read strip by strip
+                self.tile_h, self.tile_w = min(page.rowsperstrip, self.height), self.width
+        self.tiles_across = -(-self.width // self.tile_w)
+
+    def keyframe(self, tif):
+        """Return the keyframe page of the selected pyramid level of the open file <tif>."""
+        levels = tif.series[0].levels
+        assert self.level < len(levels), '%s has only %d pyramid levels' % (self.path, len(levels))
+        return levels[self.level].keyframe
+
+    def read_region(self, y, x, h, w):
+        """Return the uint8 region [y, y + h) x [x, x + w) as an (h, w) or (h, w, samples) array."""
+        assert 0 <= y and y + h <= self.height and 0 <= x and x + w <= self.width, \
+            'region (%d, %d, %d, %d) is outside of %s' % (y, x, h, w, self.path)
+        out = np.empty((h, w, self.samples), dtype=np.uint8)
+        th, tw = self.tile_h, self.tile_w
+        for row in range(y // th, (y + h - 1) // th + 1):
+            for col in range(x // tw, (x + w - 1) // tw + 1):
+                tile = self.cache.tile(self, row, col)
+                y0, y1 = max(y, row * th), min(y + h, row * th + tile.shape[0])
+                x0, x1 = max(x, col * tw), min(x + w, col * tw + tile.shape[1])
+                out[y0 - y:y1 - y, x0 - x:x1 - x] = tile[y0 - row * th:y1 - row * th, x0 - col * tw:x1 - col * tw]
+        if self.samples == 1:
+            return out[:, :, 0]
+        return out
@@ -0,0 +1,81 @@
+import os
+import random
+import torch
+import torch.utils.data
+from data.unaligned_dataset import UnalignedDataset
+
+
+class StreamDataset(UnalignedDataset, torch.utils.data.IterableDataset):
+    """
+    This dataset class streams the same unaligned data as 'unaligned', sharded across ranks and workers.
+    Every epoch has max(A_size, B_size) positions. Position i pairs A sample permA[i % A_size] with
+    B sample permB[i % B_size], where permA and permB are independent permutations seeded by
+    (--stream_seed, epoch), so all ranks and workers agree on them without communication.
+    The positions are split into world_size * num_threads disjoint shards, so no sample is loaded twice.
+    Python's and torch's RNGs are seeded per worker from (--stream_seed, epoch, shard).
+    Runs are resumed at the start of an epoch with '--continue_train --epoch_count'.
+    """
+
+    @staticmethod
+    def modify_commandline_options(parser, is_train):
+        """Add new dataset-specific options, and rewrite default values for existing options.
+        Parameters:
+            parser          -- original option parser
+            is_train (bool) -- whether training phase or test phase. You can use this flag to add training-specific or test-specific options.
+        Returns:
+            the modified parser.
+        """
+        parser = UnalignedDataset.modify_commandline_options(parser, is_train)
+        parser.add_argument('--world_size', type=int, default=int(os.environ.get('WORLD_SIZE', 1)), help='number of training processes (nodes) that share the data')
+        parser.add_argument('--rank', type=int, default=int(os.environ.get('RANK', 0)), help='index of this process among --world_size')
+        parser.add_argument('--stream_seed', type=int, default=0, help='seed of the per-epoch permutations and of the per-worker RNGs')
+        return parser
+
+    def __init__(self, opt):
+        """Initialize this dataset class.
+        Parameters:
+            opt (Option class) -- stores all the experiment flags; needs to be a subclass of BaseOptions
+        """
+        UnalignedDataset.__init__(self, opt)
+        assert 0 <= opt.rank < opt.world_size, '--rank must be in [0, --world_size)'
+        assert opt.label_sampling != 'weight', '--dataset_mode stream does not support --label_sampling weight'
+        assert opt.dedup != 'cluster', '--dataset_mode stream does not support --dedup cluster'
+        self.n_workers = max(int(opt.num_threads), 1)
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        """Select the epoch, i.e. the permutations, of the next iteration."""
+        self.epoch = epoch
+
+    def shard_positions(self, shard, n_shards):
+        """Return the epoch positions of shard <shard> of <n_shards>."""
+        return range(shard, max(self.A_size, self.B_size), n_shards)
+
+    def __len__(self):
+        """Return the number of samples this rank streams per epoch."""
+        n_shards = self.opt.world_size * self.n_workers
+        return sum(len(self.shard_positions(self.opt.rank * self.n_workers + w, n_shards)) for w in range(self.n_workers))
+
+    def permutation(self, size, domain):
+        """Return the permutation of domain 'A' or 'B' of the current epoch; identical in every rank and worker."""
+        if self.opt.serial_batches:
+            return list(range(size))
+        generator = torch.Generator()
+        generator.manual_seed((self.opt.stream_seed * 1000003 + self.epoch) * 2 + (domain == 'B'))
+        return torch.randperm(size, generator=generator).tolist()
+
+    def __iter__(self):
+        info = torch.utils.data.get_worker_info()
+        worker = info.id if info is not None else 0
+        assert info is None or info.num_workers == self.n_workers
+        shard = self.opt.rank * self.n_workers + worker
+        n_shards = self.opt.world_size * self.n_workers
+        worker_seed = (self.opt.stream_seed * 1000003 + self.epoch) * n_shards + shard
+        if info is not None:  # seed the transforms of the worker; with --num_threads 0 this is the training process, whose RNGs are left alone
+            random.seed(worker_seed)
+            torch.manual_seed(worker_seed)
+
+        perm_A = self.permutation(self.A_size, 'A')
+        perm_B = self.permutation(self.B_size, 'B')
+        for i in self.shard_positions(shard, n_shards):
+            yield self.get_pair(perm_A[i % self.A_size], perm_B[i % self.B_size])
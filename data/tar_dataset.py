@@ -0,0 +1,138 @@
+import random
+import torch
+import torch.utils.data
+from data.base_dataset import BaseDataset, get_transform
+from data.tar_store import load_tar_index, iter_tar
+from data.decoders import get_decoder
+from PIL import Image
+
+
+class TarDataset(BaseDataset, torch.utils.data.IterableDataset):
+    """
+    This dataset class streams the same unaligned data as 'unaligned' from sequential tar shards.
+    The shards of domain A are shuffled every epoch and split among the data loading workers; each
+    worker reads its shards front to back and shuffles the samples in a buffer of --shuffle_buffer
+    samples. Like 'unaligned', every A sample is paired with a random B sample: a second buffer is
+    filled from the B shards, cycled forever in a shuffled order, and the partner is drawn from it.
+    An epoch is one pass over domain A. Streams are seeded by (--shard_seed, epoch, worker).
+    Build the shards once with 'python -m util.pack_tars --dataroot /path/to/data'.
+    """
+
+    @staticmethod
+    def modify_commandline_options(parser, is_train):
+        """Add new dataset-specific options, and rewrite default values for existing options.
+        Parameters:
+            parser          -- original option parser
+            is_train (bool) -- whether training phase or test phase. You can use this flag to add training-specific or test-specific options.
+        Returns:
+            the modified parser.
+        """
+        parser.add_argument('--shuffle_buffer', type=int, default=1000, help='number of samples per domain each worker keeps in memory to shuffle the stream')
+        parser.add_argument('--shard_seed', type=int, default=0, help='seed of the shard order and of the shuffle buffers')
+        return parser
+
+    def __init__(self, opt):
+        """Initialize this dataset class.
+        Parameters:
+            opt (Option class) -- stores all the experiment flags; needs to be a subclass of BaseOptions
+        """
+        BaseDataset.__init__(self, opt)
+        self.shards_A = load_tar_index(opt.dataroot, opt.phase, 'A')
+        self.shards_B = load_tar_index(opt.dataroot, opt.phase, 'B')
+        self.A_size = sum(shard['samples'] for shard in self.shards_A)
+        assert self.shards_B and self.shards_B[0]['samples'] > 0, 'domain B of %s has no tar shards' % opt.phase
+        self.n_workers = max(int(opt.num_threads), 1)
+        if len(self.shards_A) < self.n_workers:
+            print('only %d tar shards of domain A for %d workers; some workers will be idle' % (len(self.shards_A), self.n_workers))
+        self.decode = get_decoder(opt.decoder)
+        self.transform_img = get_transform(self.opt, grayscale=False)
+        self.transform_gt = get_transform(self.opt, grayscale=True)
+        self.transform_label = get_transform(self.opt, grayscale=True, label=True)
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        """Select the epoch, i.e. the shard order and the shuffle seeds, of the next iteration."""
+        self.epoch = epoch
+
+    def worker_shards(self, worker):
+        """Return the A shards of <worker> for the current epoch; the order is the same in all workers."""
+        shards = list(self.shards_A)
+        if not self.opt.serial_batches:
+            random.Random(self.opt.shard_seed * 1000003 + self.epoch).shuffle(shards)
+        return shards[worker::self.n_workers]
+
+    def stream(self, shards, rng, cycle=False):
+        """Yield the samples of <shards> in order, again and again in a new shuffled order if <cycle>."""
+        while True:
+            for shard in shards:
+                for sample in iter_tar(shard['path']):
+                    yield sample
+            if not cycle:
+                return
+            shards = list(shards)
+            rng.shuffle(shards)
+
+    def shuffled(self, samples, rng):
+        """Shuffle a stream with a buffer of --shuffle_buffer samples."""
+        if self.opt.serial_batches or self.opt.shuffle_buffer <= 1:
+            yield from samples
+            return
+        buffer = []
+        for sample in samples:
+            if len(buffer) < self.opt.shuffle_buffer:
+                buffer.append(sample)
+                continue
+            i = rng.randrange(len(buffer))
+            yield buffer[i]
+            buffer[i] = sample
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def load(self, sample, mode):
+        """Decode a tar sample into (image, cell, layer) tensors."""
+        img = self.decode(sample['img'], mode)
+        cell = self.decode(sample['cell'], 'L')
+        layer = self.decode(sample['layer'], 'L')
+        transform = self.transform_img if mode == 'RGB' else self.transform_gt
+        return transform(Image.fromarray(img)), self.transform_label(Image.fromarray(cell)), self.transform_label(Image.fromarray(layer))
+
+    def __iter__(self):
+        info = torch.utils.data.get_worker_info()
+        worker = info.id if info is not None else 0
+        assert info is None or info.num_workers == self.n_workers
+        rng = random.Random((self.opt.shard_seed * 1000003 + self.epoch) * self.n_workers + worker)
+        if info is not None:  # seed the transforms of the worker; with --num_threads 0 this is the training process, whose RNGs are left alone
+            random.seed(rng.random())
+            torch.manual_seed(rng.randrange(2 ** 63))
+
+        stream_A = self.shuffled(self.stream(self.worker_shards(worker), rng), rng)
+        shards_B = list(self.shards_B)
+        rng.shuffle(shards_B)
+        stream_B = self.stream(shards_B, rng, cycle=True)
+        pool_B = []  # partners are drawn from here and replaced with the next sample of the B stream
+        for sample_A in stream_A:
+            if self.opt.serial_batches:
+                sample_B = next(stream_B)
+            else:
+                while len(pool_B) < max(self.opt.shuffle_buffer, 1):
+                    pool_B.append(next(stream_B))
+                i = rng.randrange(len(pool_B))
+                sample_B = pool_B[i]
+                pool_B[i] = next(stream_B)
+            A, A_gt_cell, A_gt_line = self.load(sample_A, 'RGB')
+            B, B_gt_cell, B_gt_line = self.load(sample_B, 'L')
+            record_A, record_B = sample_A['record'], sample_B['record']
+            yield {'A': A, 'B': B,
+                   'A_gt_cell': A_gt_cell, 'B_gt_cell': B_gt_cell,
+                   'A_gt_line': A_gt_line, 'B_gt_line': B_gt_line,
+                   'A_paths': record_A['path'], 'B_paths': record_B['path'],
+                   'gt_A_cell_path': record_A['cell_path'], 'gt_B_cell_path': record_B['cell_path'],
+                   'gt_A_line_path': record_A['layer_path'], 'gt_B_line_path': record_B['layer_path']}
+
+    def __getitem__(self, index):
+        """Tar shards are read sequentially; the dataset can only be iterated."""
+        raise NotImplementedError('--dataset_mode tar streams its samples and does not support random access')
+
+    def __len__(self):
+        """Return the number of A samples, i.e. the length of an epoch."""
+        return min(self.A_size, self.opt.max_dataset_size)
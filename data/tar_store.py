@@ -0,0 +1,109 @@
+"""Sequential tar shards (WebDataset-style) for the unaligned dataset layout.
+
+One domain of one phase (e.g. '/path/to/data/trainA' together with 'trainA_cell' and
+'trainA_layer') is packed into the directory '/path/to/data/trainA.tars/' as numbered tar files
+'shard-00000.tar', 'shard-00001.tar', ... Every sample is stored as consecutive members that share
+a key: '[key].img.[ext]', '[key].cell.[ext]', '[key].layer.[ext]' with the original, still encoded
+file bytes, and '[key].json' with the original paths. Reading a shard is a single sequential pass,
+which suits network file systems and object stores much better than six random file opens per sample.
+'index.json' in the directory lists the shards and their sample counts.
+
+Use 'python -m util.pack_tars --dataroot /path/to/data' to build the shards.
+"""
+import io
+import os
+import json
+import random
+import tarfile
+from data.manifest import Manifest
+
+TAR_VERSION = 1
+
+
+def tar_dir(dataroot, phase, domain):
+    """Return the directory of the tar shards of <phase><domain>, e.g. 'trainA.tars'."""
+    return os.path.join(dataroot, phase + domain + '.tars')
+
+
+def _add_member(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def pack_tars(dataroot, phase, domain, samples_per_shard=1000, max_dataset_size=float("inf"), manifest=None, seed=0):
+    """Pack the images and the cell/layer labels of one domain into sequential tar shards.
+
+    Parameters:
+        dataroot (str)          -- path to the dataset root that contains [phase][domain], [phase][domain]_cell, ...
+        phase (str)             -- train, test, etc
+        domain (str)            -- A or B
+        samples_per_shard (int) -- number of samples per tar file
+        max_dataset_size (int)  -- maximum number of samples to pack
+        manifest (Manifest)     -- file manifest of <phase>; a new one is loaded and saved if not given
+        seed (int)              -- seed of the order of the samples; neighbouring tiles land in different shards
+
+    Returns the number of packed samples.
+    """
+    if manifest is None:
+        manifest = Manifest(dataroot, phase)
+        samples = list(zip(*manifest.paired(domain, max_dataset_size)))
+        manifest.save()
+    else:
+        samples = list(zip(*manifest.paired(domain, max_dataset_size)))
+    random.Random(seed).shuffle(samples)
+
+    out_dir = tar_dir(dataroot, phase, domain)
+    os.makedirs(out_dir, exist_ok=True)
+    shards = []
+    for start in range(0, len(samples), samples_per_shard):
+        name = 'shard-%05d.tar' % len(shards)
+        path = os.path.join(out_dir, name)
+        with tarfile.open(path + '.tmp', 'w') as tar:
+            for i, paths in enumerate(samples[start:start + samples_per_shard]):
+                key = '%08d' % (start + i)
+                for kind, file_path in zip(['img', 'cell', 'layer'], paths):
+                    with open(file_path, 'rb') as f:
+                        _add_member(tar, '%s.%s%s' % (key, kind, os.path.splitext(file_path)[1].lower()), f.read())
+                record = {'path': paths[0], 'cell_path': paths[1], 'layer_path': paths[2]}
+                _add_member(tar, key + '.json', json.dumps(record).encode())
+        os.replace(path + '.tmp', path)
+        shards.append({'name': name, 'samples': len(samples[start:start + samples_per_shard])})
+    with open(os.path.join(out_dir, 'index.json'), 'w') as f:
+        json.dump({'version': TAR_VERSION, 'shards': shards}, f)
+    return len(samples)
+
+
+def load_tar_index(dataroot, phase, domain):
+    """Return the list of {'path', 'samples'} of the tar shards of <phase><domain>."""
+    out_dir = tar_dir(dataroot, phase, domain)
+    index_path = os.path.join(out_dir, 'index.json')
+    assert os.path.isfile(index_path), '%s is not a valid tar shard index; run "python -m util.pack_tars" first' % index_path
+    with open(index_path) as f:
+        index = json.load(f)
+    if index.get('version') != TAR_VERSION:
+        raise RuntimeError('tar shards %s have version %s, expected %d; re-run "python -m util.pack_tars"' % (index_path, index.get('version'), TAR_VERSION))
+    return [{'path': os.path.join(out_dir, shard['name']), 'samples': shard['samples']} for shard in index['shards']]
+
+
+def iter_tar(path):
+    """Yield the samples of one tar shard in order, each a dict kind -> bytes ('img', 'cell', 'layer')
+    plus 'record' with the original paths. The file is read in a single sequential pass.
+    """
+    sample, key = {}, None
+    with tarfile.open(path, 'r|') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            member_key, kind = member.name.split('.')[:2]
+            if member_key != key and sample:
+                yield sample
+                sample = {}
+            key = member_key
+            data = tar.extractfile(member).read()
+            if kind == 'json':
+                sample['record'] = json.loads(data)
+            else:
+                sample[kind] = data
+    if sample:
+        yield sample
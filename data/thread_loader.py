@@ -0,0 +1,110 @@
+"""A thread-pool alternative to the worker processes of torch's DataLoader ('--loader_backend thread').
+
+Decoding with PIL (and cv2/turbojpeg) releases the GIL, so threads of the training process can
+decode in parallel without pickling every sample across a process boundary and without
+duplicating the dataset state in every worker. Samples are copied straight into preallocated
+batch buffers: a small ring of buffer sets is allocated on the first batch and reused for the
+rest of the run, so no per-batch tensors are allocated either. Samples of different shapes, or
+custom collate functions ('--size_buckets', '--crops_per_sample'), fall back to <collate_fn>.
+Use 'python -m util.benchmark_loader' to compare both backends on your data.
+"""
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import torch
+
+_END = object()
+
+
+class ThreadBatchLoader():
+    """Load the batches of <batch_sampler> from a map-style dataset with a pool of threads."""
+
+    def __init__(self, dataset, batch_sampler, num_threads, depth=2, collate_fn=None, pin_memory=False, held_batches=1):
+        """Initialize the loader.
+
+        Parameters:
+            dataset (Dataset)       -- a map-style dataset whose samples are dictionaries
+            batch_sampler (Sampler) -- yields lists of at most <batch_sampler.batch_size> dataset indices
+            num_threads (int)       -- number of decoding threads
+            depth (int)             -- number of batches loaded ahead of the consumer
+            collate_fn (function)   -- if given, used instead of the preallocated buffers
+            pin_memory (bool)       -- allocate the buffers in page-locked memory
+            held_batches (int)      -- number of batches the consumer may still use when it asks for the next one,
+                                       e.g. 1 + the queue of a DevicePrefetcher on the CPU
+        """
+        self.dataset = dataset
+        self.batch_sampler = batch_sampler
+        self.num_threads = max(num_threads, 1)
+        self.depth = depth
+        self.collate_fn = collate_fn
+        self.pin_memory = pin_memory
+        self.held_batches = held_batches
+        self.buffers = []  # ring of buffer sets: key -> (batch_size, ...) tensor
+        self.next_buffer = 0
+
+    def __len__(self):
+        return len(self.batch_sampler)
+
+    def _allocate(self, sample):
+        """Allocate one buffer set for every batch that can be alive at once: queued, being filled or held by the consumer."""
+        for _ in range(self.depth + 1 + self.held_batches):
+            buffers = {}
+            for key, value in sample.items():
+                if isinstance(value, torch.Tensor):
+                    buffers[key] = torch.empty((self.batch_sampler.batch_size,) + tuple(value.shape), dtype=value.dtype, pin_memory=self.pin_memory)
+            self.buffers.append(buffers)
+
+    def _collate(self, samples):
+        """Copy <samples> into the next buffer set, or collate them with <collate_fn> if that is impossible."""
+        if self.collate_fn is not None:
+            return self.collate_fn(samples)
+        if not self.buffers:
+            self._allocate(samples[0])
+        buffers = self.buffers[self.next_buffer]
+        if any(sample[key].shape != buffer.shape[1:] for sample in samples for key, buffer in buffers.items()):
+            raise RuntimeError('--loader_backend thread needs samples of one size; use --size_buckets for variable-size images')
+        self.next_buffer = (self.next_buffer + 1) % len(self.buffers)
+        batch = {}
+        for key, value in samples[0].items():
+            if key in buffers:
+                for j, sample in enumerate(samples):
+                    buffers[key][j].copy_(sample[key])
+                batch[key] = buffers[key][:len(samples)]
+            else:
+                batch[key] = [sample[key] for sample in samples]
+        return batch
+
+    def _produce(self, pool, batches, stop):
+        try:
+            for indices in self.batch_sampler:
+                if stop.is_set():
+                    return
+                samples = list(pool.map(self.dataset.__getitem__, indices))
+                batches.put(self._collate(samples))
+        except Exception as e:  # re-raised in the consumer thread
+            batches.put(e)
+            return
+        batches.put(_END)
+
+    def __iter__(self):
+        batches = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+        pool = ThreadPoolExecutor(self.num_threads)
+        thread = threading.Thread(target=self._produce, args=(pool, batches, stop), daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = batches.get()
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:  # the consumer stopped early: unblock the producer and let it finish
+            stop.set()
+            while thread.is_alive():
+                try:
+                    batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            pool.shutdown()
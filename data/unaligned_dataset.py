@@ -1,7 +1,17 @@
 import os
-from data.base_dataset import BaseDataset, get_transform
+from data.base_dataset import BaseDataset, get_params, get_transform
 from data.image_folder import make_dataset
+from data.manifest import Manifest
+from data.sample_cache import SharedSampleCache
+from data.label_pack import LabelPackReader
+from data.decoders import load_image, read_size
+from data.label_stats import load_label_stats, is_informative
+from data.dedup_index import load_clusters
 from PIL import Image
+import numpy as np
+import bisect
+import collections
+import itertools
 import random
 
 
@@ -15,12 +25,35 @@ class UnalignedDataset(BaseDataset):
     '/path/to/data/testA' and '/path/to/data/testB' during test time.
     """
 
+    @staticmethod
+    def modify_commandline_options(parser, is_train):
+        """Add new dataset-specific options, and rewrite default values for existing options.
+        Parameters:
+            parser          -- original option parser
+            is_train (bool) -- whether training phase or test phase. You can use this flag to add training-specific or test-specific options.
+        Returns:
+            the modified parser.
+        """
+        parser.add_argument('--use_manifest', action='store_true', help='pair the images with their _cell/_layer labels by file name using a cached file manifest instead of by position in the sorted directory listings')
+        parser.add_argument('--manifest_dir', type=str, default='', help='where to keep the file manifest of --use_manifest; defaults to [checkpoints_dir]/[name]')
+        parser.add_argument('--verify_manifest', action='store_true', help='check size and mtime of every cached file, not only of its directory')
+        parser.add_argument('--packed_labels', action='store_true', help='read the cell and layer labels from the bit-packed files written by util/pack_labels.py')
+        parser.add_argument('--label_stats', action='store_true', help='load the label statistics index built by util/build_label_stats.py and pass the per-sample layer range to the model')
+        parser.add_argument('--label_sampling', type=str, default='none', help='how to treat tiles without nuclei and with a single layer, needs --label_stats [none | skip | weight]')
+        parser.add_argument('--min_cell_fraction', type=float, default=0.001, help='tiles whose cell mask covers less than this fraction are uninformative unless they show several layers')
+        parser.add_argument('--uninformative_weight', type=float, default=0.1, help='relative sampling weight of uninformative tiles with --label_sampling weight')
+        parser.add_argument('--dedup', type=str, default='none', help='how to treat near-duplicate tiles of the index built by util/build_dedup_index.py [none | representative | cluster]: train on one tile per cluster, or weight every tile by 1 / cluster size')
+        parser.add_argument('--crops_per_sample', type=int, default=1, help='if > 1, cut this many aligned --crop_size crops from every decoded pair; a batch then holds batch_size * crops_per_sample samples (needs --preprocess crop)')
+        parser.add_argument('--sample_cache_mb', type=int, default=0, help='if > 0, keep up to this many MB of decoded samples in shared memory for all data loading workers (needs enough space in /dev/shm)')
+        return parser
+
     def __init__(self, opt):
         """Initialize this dataset class.
         Parameters:
             opt (Option class) -- stores all the experiment flags; needs to be a subclass of BaseOptions
         """
         BaseDataset.__init__(self, opt)
+        assert opt.crops_per_sample == 1 or opt.preprocess == 'crop', '--crops_per_sample needs --preprocess crop'
         self.dir_A = os.path.join(opt.dataroot, opt.phase + 'A')  # path to A domain image
         self.dir_B = os.path.join(opt.dataroot, opt.phase + 'B')  # path to B domain image
         self.dir_gt_A_cell = os.path.join(opt.dataroot, opt.phase + 'A_cell')  # path to A domain cell nuclei anotation
@@ -28,21 +61,127 @@ class UnalignedDataset(BaseDataset):
         self.dir_gt_A_line = os.path.join(opt.dataroot, opt.phase + 'A_layer') # path to A domain skin layers anotation
         self.dir_gt_B_line = os.path.join(opt.dataroot, opt.phase + 'B_layer') # path to B domain skin layers anotation
 
-        self.A_paths = sorted(make_dataset(self.dir_A, opt.max_dataset_size))   # load images from '/path/to/data/trainA'
-        self.B_paths = sorted(make_dataset(self.dir_B, opt.max_dataset_size))    # load images from '/path/to/data/trainB'
-        self.gt_A_cell_paths = sorted(make_dataset(self.dir_gt_A_cell, opt.max_dataset_size))  
-        self.gt_B_cell_paths = sorted(make_dataset(self.dir_gt_B_cell, opt.max_dataset_size))
-        self.gt_A_line_paths = sorted(make_dataset(self.dir_gt_A_line, opt.max_dataset_size))  
-        self.gt_B_line_paths = sorted(make_dataset(self.dir_gt_B_line, opt.max_dataset_size))
+        if not opt.use_manifest:
+            self.A_paths = sorted(make_dataset(self.dir_A, opt.max_dataset_size))   # load images from '/path/to/data/trainA'
+            self.B_paths = sorted(make_dataset(self.dir_B, opt.max_dataset_size))    # load images from '/path/to/data/trainB'
+            self.gt_A_cell_paths = sorted(make_dataset(self.dir_gt_A_cell, opt.max_dataset_size))
+            self.gt_B_cell_paths = sorted(make_dataset(self.dir_gt_B_cell, opt.max_dataset_size))
+            self.gt_A_line_paths = sorted(make_dataset(self.dir_gt_A_line, opt.max_dataset_size))
+            self.gt_B_line_paths = sorted(make_dataset(self.dir_gt_B_line, opt.max_dataset_size))
+        else:  # cached listings, labels paired with their images by file name
+            manifest = Manifest(opt.dataroot, opt.phase, opt.manifest_dir or os.path.join(opt.checkpoints_dir, opt.name), opt.verify_manifest)
+            self.A_paths, self.gt_A_cell_paths, self.gt_A_line_paths = manifest.paired('A', opt.max_dataset_size)
+            self.B_paths, self.gt_B_cell_paths, self.gt_B_line_paths = manifest.paired('B', opt.max_dataset_size)
+            manifest.save()
         
+        self.stats_A = self.stats_B = None
+        self.sample_weights = None  # per-index sampling weights for CustomDatasetDataLoader
+        self.cum_weights_B = None
+        if opt.label_stats:
+            self.stats_A = load_label_stats(opt.dataroot, opt.phase, 'A', self.A_paths)
+            self.stats_B = load_label_stats(opt.dataroot, opt.phase, 'B', self.B_paths)
+            if opt.label_sampling == 'skip':
+                self.skip_uninformative()
+        else:
+            assert opt.label_sampling == 'none', '--label_sampling needs --label_stats'
+        self.clusters_A = self.clusters_B = None
+        if opt.dedup != 'none':
+            self.clusters_A = load_clusters(opt.dataroot, opt.phase, 'A', self.A_paths)
+            self.clusters_B = load_clusters(opt.dataroot, opt.phase, 'B', self.B_paths)
+            if opt.dedup == 'representative':
+                self.keep_representatives()
+
         self.A_size = len(self.A_paths)  # get the size of dataset A
         self.B_size = len(self.B_paths)  # get the size of dataset B
+        weights_A, weights_B = [1.0] * self.A_size, [1.0] * self.B_size
+        if opt.label_sampling == 'weight':
+            weight = lambda stats: 1.0 if is_informative(stats, opt.min_cell_fraction) else opt.uninformative_weight
+            weights_A = [weight(stats) for stats in self.stats_A]
+            weights_B = [weight(stats) for stats in self.stats_B]
+        if opt.dedup == 'cluster':  # every cluster of near-duplicates is as likely as a single tile
+            for weights, clusters in [(weights_A, self.clusters_A), (weights_B, self.clusters_B)]:
+                sizes = collections.Counter(clusters)
+                for i, cluster in enumerate(clusters):
+                    weights[i] /= sizes[cluster]
+        elif opt.dedup not in ['none', 'representative']:
+            raise NotImplementedError('--dedup [%s] is not recognized' % opt.dedup)
+        if opt.label_sampling == 'weight' or opt.dedup == 'cluster':
+            self.sample_weights = [weights_A[i % self.A_size] for i in range(len(self))]
+            self.cum_weights_B = list(itertools.accumulate(weights_B))
 
         btoA = self.opt.direction == 'BtoA'
         input_nc = self.opt.output_nc if btoA else self.opt.input_nc       # get the number of channels of input image
         output_nc = self.opt.input_nc if btoA else self.opt.output_nc      # get the number of channels of output image
         self.transform_img = get_transform(self.opt, grayscale=False)
         self.transform_gt = get_transform(self.opt, grayscale=True)
+        self.transform_label = get_transform(self.opt, grayscale=True, label=True)
+        self.label_packs = None
+        if opt.packed_labels:
+            self.label_packs = {}
+            for domain, img_paths in [('A', self.A_paths), ('B', self.B_paths)]:
+                cell = LabelPackReader(opt.dataroot, opt.phase + domain + '_cell')
+                layer = LabelPackReader(opt.dataroot, opt.phase + domain + '_layer')
+                positions = {p: i for i, p in enumerate(cell.image_paths())}
+                rel_paths = [os.path.relpath(p, opt.dataroot) for p in img_paths]  # the packs store paths relative to the dataroot
+                if layer.image_paths() != cell.image_paths() or any(p not in positions for p in rel_paths):
+                    raise RuntimeError('the label packs of %s%s do not match its images; re-run "python -m util.pack_labels"' % (opt.phase, domain))
+                self.label_packs[domain] = (cell, layer, [positions[p] for p in rel_paths])
+        self.cache = None
+        if opt.sample_cache_mb > 0:  # created before the workers start so that all of them share it
+            self.cache = SharedSampleCache(self.A_size + self.B_size, opt.sample_cache_mb * 1024 * 1024)
+
+    def skip_uninformative(self):
+        """Drop the tiles without nuclei and with a single skin layer from both domains."""
+        for domain in ['A', 'B']:
+            stats = getattr(self, 'stats_' + domain)
+            keep = [i for i, st in enumerate(stats) if is_informative(st, self.opt.min_cell_fraction)]
+            assert len(keep) > 0, 'all tiles of domain %s are uninformative; lower --min_cell_fraction' % domain
+            print('skipping %d of %d uninformative tiles of domain %s' % (len(stats) - len(keep), len(stats), domain))
+            self.keep_samples(domain, keep)
+
+    def keep_representatives(self):
+        """Keep only the first remaining tile of every cluster of near-duplicates in both domains."""
+        for domain in ['A', 'B']:
+            clusters = getattr(self, 'clusters_' + domain)
+            first = {}
+            for i, cluster in enumerate(clusters):
+                first.setdefault(cluster, i)
+            keep = sorted(first.values())
+            print('keeping %d representatives of %d tiles of domain %s' % (len(keep), len(clusters), domain))
+            self.keep_samples(domain, keep)
+
+    def keep_samples(self, domain, keep):
+        """Restrict the paths and per-sample indexes of <domain> to the positions <keep>."""
+        for name in ['%s_paths', 'gt_%s_cell_paths', 'gt_%s_line_paths', 'stats_%s', 'clusters_%s']:
+            values = getattr(self, name % domain, None)
+            if values is not None:
+                setattr(self, name % domain, [values[i] for i in keep])
+
+    def load_sample(self, domain, index):
+        """Return the decoded uint8 image, cell label and layer label of sample <index> of domain 'A' or 'B'.
+        The image of domain A is (H, W, 3) RGB, the image of domain B and the labels are (H, W) grayscale.
+        """
+        key = index if domain == 'A' else self.A_size + index  # A and B share the cache
+        if self.cache is not None:
+            sample = self.cache.get(key)
+            if sample is not None:
+                return sample
+        if domain == 'A':
+            paths = self.A_paths[index], self.gt_A_cell_paths[index], self.gt_A_line_paths[index]
+        else:
+            paths = self.B_paths[index], self.gt_B_cell_paths[index], self.gt_B_line_paths[index]
+        # domain B only goes through <transform_gt>, so it is decoded straight to one channel
+        img = load_image(paths[0], 'RGB' if domain == 'A' else 'L', self.opt.decoder)
+        if self.label_packs is not None:
+            cell_pack, layer_pack, positions = self.label_packs[domain]
+            cell = cell_pack.read(positions[index])
+            layer = layer_pack.read(positions[index])
+        else:
+            cell = load_image(paths[1], 'L', self.opt.decoder)
+            layer = load_image(paths[2], 'L', self.opt.decoder)
+        if self.cache is not None:
+            self.cache.put(key, img, cell, layer)
+        return img, cell, layer
 
     def __getitem__(self, index):
         """Return a data point and its metadata information.
@@ -54,37 +193,78 @@ class UnalignedDataset(BaseDataset):
             A_paths (str)    -- image paths
             B_paths (str)    -- image paths
         """
-        A_path = self.A_paths[index % self.A_size]  # make sure index is within then range
-        gt_A_cell_path = self.gt_A_cell_paths[index % self.A_size]
-        gt_A_line_path = self.gt_A_line_paths[index % self.A_size]
+        index_A = index % self.A_size  # make sure index is within then range
         if self.opt.serial_batches:   # make sure index is within then range
             index_B = index % self.B_size
+        elif self.cum_weights_B is not None:   # draw domain B by label statistics weight
+            index_B = min(bisect.bisect_right(self.cum_weights_B, random.random() * self.cum_weights_B[-1]), self.B_size - 1)
         else:   # randomize the index for domain B to avoid fixed pairs.
             index_B = random.randint(0, self.B_size - 1)
+        return self.get_pair(index_A, index_B)
+
+    def get_pair(self, index_A, index_B):
+        """Return the data point made of sample <index_A> of domain A and sample <index_B> of domain B."""
+        A_path = self.A_paths[index_A]
+        gt_A_cell_path = self.gt_A_cell_paths[index_A]
+        gt_A_line_path = self.gt_A_line_paths[index_A]
         B_path = self.B_paths[index_B]
         gt_B_cell_path = self.gt_B_cell_paths[index_B]
         gt_B_line_path = self.gt_B_line_paths[index_B]
         
-        A_img = Image.open(A_path).convert('RGB')
-        B_img = Image.open(B_path).convert('RGB')
-        gt_A_cell_img = Image.open(gt_A_cell_path).convert('L')
-        gt_B_cell_img = Image.open(gt_B_cell_path).convert('L')
-        gt_A_line_img = Image.open(gt_A_line_path).convert('L')
-        gt_B_line_img = Image.open(gt_B_line_path).convert('L')
+        sample_A = self.load_sample('A', index_A)
+        sample_B = self.load_sample('B', index_B)
+        paths = {'A_paths': A_path, 'B_paths': B_path,
+                 'gt_A_cell_path': gt_A_cell_path, 'gt_B_cell_path': gt_B_cell_path,
+                 'gt_A_line_path': gt_A_line_path, 'gt_B_line_path': gt_B_line_path}
+        if self.opt.crops_per_sample > 1:  # amortize the decode over several crops; <collate_crops> flattens them into the batch
+            return {'crops': [self.transform_pair(self.crop_sample(sample_A), self.crop_sample(sample_B), paths)
+                              for _ in range(self.opt.crops_per_sample)]}
+        data = self.transform_pair(sample_A, sample_B, paths)
+        if self.stats_A is not None:  # raw uint8 layer range, so that the model does not recompute it
+            data['A_line_min'] = self.stats_A[index_A]['layer_min']
+            data['A_line_max'] = self.stats_A[index_A]['layer_max']
+            data['B_line_min'] = self.stats_B[index_B]['layer_min']
+            data['B_line_max'] = self.stats_B[index_B]['layer_max']
+        return data
+
+    def crop_sample(self, sample):
+        """Cut one random crop, flipped at random unless --no_flip, out of an (image, cell, layer) sample.
+        The crop and flip parameters come from <get_params>, so the three arrays stay aligned.
+        The label statistics describe the whole file, so no layer range is passed on for crops.
+        """
+        h, w = sample[0].shape[:2]
+        params = get_params(self.opt, (w, h))
+        x, y = params['crop_pos']
+        crops = []
+        for array in sample:
+            array = array[y:y + self.opt.crop_size, x:x + self.opt.crop_size]
+            if params['flip'] and not self.opt.no_flip:
+                array = array[:, ::-1]
+            crops.append(np.ascontiguousarray(array))
+        return crops
+
+    def transform_pair(self, sample_A, sample_B, paths):
+        """Return the data point made of the (image, cell, layer) arrays of both domains and their <paths>."""
+        A_img, gt_A_cell_img, gt_A_line_img = sample_A
+        B_img, gt_B_cell_img, gt_B_line_img = sample_B
         # apply image transformation
-        A = self.transform_img(A_img)
-        B = self.transform_gt(B_img)
-        A_gt_cell = self.transform_gt(gt_A_cell_img)
-        B_gt_cell = self.transform_gt(gt_B_cell_img)
-        A_gt_line = self.transform_gt(gt_A_line_img)
-        B_gt_line = self.transform_gt(gt_B_line_img)
-
-        return {'A': A, 'B': B, 
+        A = self.transform_img(Image.fromarray(A_img))
+        B = self.transform_gt(Image.fromarray(B_img))
+        A_gt_cell = self.transform_label(Image.fromarray(gt_A_cell_img))
+        B_gt_cell = self.transform_label(Image.fromarray(gt_B_cell_img))
+        A_gt_line = self.transform_label(Image.fromarray(gt_A_line_img))
+        B_gt_line = self.transform_label(Image.fromarray(gt_B_line_img))
+
+        data = {'A': A, 'B': B,
                 'A_gt_cell': A_gt_cell, 'B_gt_cell': B_gt_cell,
-                'A_gt_line': A_gt_line, 'B_gt_line': B_gt_line, 
-                'A_paths': A_path, 'B_paths': B_path, 
-                'gt_A_cell_path': gt_A_cell_path, 'gt_B_cell_path': gt_B_cell_path,
-                'gt_A_line_path': gt_A_line_path, 'gt_B_line_path': gt_B_line_path}
+                'A_gt_line': A_gt_line, 'B_gt_line': B_gt_line}
+        data.update(paths)
+        return data
+
+    def sample_sizes(self):
+        """Return the (height, width) of image A of every data point, read from the file headers."""
+        sizes_A = [read_size(path) for path in self.A_paths]
+        return [sizes_A[i % self.A_size] for i in range(len(self))]
 
     def __len__(self):
         """Return the total number of images in the dataset.
@@ -3,6 +3,7 @@ import torch
 from collections import OrderedDict
 from abc import ABC, abstractmethod
 from . import networks
+from data.base_dataset import normalize_batch
 
 
 class BaseModel(ABC):
@@ -32,13 +33,14 @@ class BaseModel(ABC):
         self.isTrain = opt.isTrain
         self.device = torch.device('cuda:{}'.format(self.gpu_ids[0])) if self.gpu_ids else torch.device('cpu')  # get device name: CPU or GPU
         self.save_dir = os.path.join(opt.checkpoints_dir, opt.name)  # save all the checkpoints to save_dir
-        if opt.preprocess != 'scale_width':  # with [scale_width], input images might have different sizes, which hurts the performance of cudnn.benchmark.
-            torch.backends.cudnn.benchmark = True
+        if opt.preprocess != 'scale_width' or opt.size_buckets:  # with [scale_width], input images might have different sizes, which hurts the performance of cudnn.benchmark.
+            torch.backends.cudnn.benchmark = True  # size buckets keep the number of distinct shapes small
         self.loss_names = []
         self.model_names = []
         self.visual_names = []
         self.optimizers = []
         self.image_paths = []
+        self.visual_sizes = {}  # visual name -> (N, 2) tensor of the unpadded sizes of a '--size_buckets' batch
         self.metric = 0  # used for learning rate policy 'plateau'
 
     @staticmethod
@@ -60,6 +62,21 @@ class BaseModel(ABC):
         """
         pass
 
+    def to_input(self, tensor):
+        """Move an input batch to the device; uint8 batches ('--uint8_batches') are normalized to [-1, 1] there.
+        Batches that are already resident on the device ('--device_prefetch') are returned as they are.
+        """
+        tensor = tensor.to(self.device, non_blocking=True)
+        if tensor.dtype == torch.uint8:
+            tensor = normalize_batch(tensor)
+        return tensor
+
+    def to_label(self, tensor):
+        """Move a label batch to the device; uint8 class maps ('--compact_labels') are not normalized."""
+        if self.opt.compact_labels:
+            return tensor.to(self.device, non_blocking=True)
+        return self.to_input(tensor)
+
     @abstractmethod
     def forward(self):
         """Run forward pass; called by both functions <optimize_parameters> and <test>."""
@@ -123,7 +140,21 @@ class BaseModel(ABC):
         visual_ret = OrderedDict()
         for name in self.visual_names:
             if isinstance(name, str):
-                visual_ret[name] = getattr(self, name)
+                visual = getattr(self, name)
+                if visual.dtype == torch.uint8:  # label class maps of '--compact_labels'
+                    visual = normalize_batch(visual)
+                visual_ret[name] = visual
+        return visual_ret
+
+    def get_sample_visuals(self, index):
+        """Return the visualization images of sample <index> of the batch, without the padding of '--size_buckets'."""
+        visual_ret = OrderedDict()
+        for name, visual in self.get_current_visuals().items():
+            visual = visual[index:index + 1]
+            if name in self.visual_sizes:
+                h, w = self.visual_sizes[name][index].tolist()
+                visual = visual[:, :, :h, :w]
+            visual_ret[name] = visual
         return visual_ret
 
     def get_current_losses(self):
@@ -2,9 +2,11 @@ import torch
 import os
 import itertools
 from util.image_pool import ImagePool
+from util.pseudo_label_cache import PseudoLabelCache
 from .base_model import BaseModel
 import torchvision.transforms as T
 from . import networks
+from data.base_dataset import normalize_batch
 from PIL import Image
 import numpy as np
 import matplotlib.pyplot as plt
@@ -36,10 +38,14 @@ class CycleGANModel(BaseModel):
         Dropout is not used in the original CycleGAN paper.
         """
         parser.set_defaults(no_dropout=True)  # default CycleGAN did not use dropout
+        parser.add_argument('--compile_mode', type=str, default='none', help='compile the networks, the noisy translations and the losses into fused graphs [none | compile | script]: torch.compile, or TorchScript for the networks only')
         if is_train:
             parser.add_argument('--lambda_A', type=float, default=10.0, help='weight for cycle loss (A -> B -> A)')
             parser.add_argument('--lambda_B', type=float, default=10.0, help='weight for cycle loss (B -> A -> B)')
             parser.add_argument('--lambda_identity', type=float, default=0, help='use identity mapping. Setting lambda_identity other than 0 has an effect of scaling the weight of the identity mapping loss. For example, if the weight of the identity loss should be 10 times smaller than the weight of the reconstruction loss, please set lambda_identity = 0.1')
+            parser.add_argument('--pseudo_label_refresh', type=int, default=1, help='if > 1, cache the nuclei the segmentors predict on the fake images per sample and refresh them every k steps; needs a deterministic sample geometry (no random crops, flips or rotations)')
+            parser.add_argument('--pseudo_label_mode', type=str, default='step', help='which cached pseudo-labels are refreshed [step | rotate]: all of them every --pseudo_label_refresh steps, or a rotating 1 / --pseudo_label_refresh of the batch every step')
+            parser.add_argument('--pseudo_label_staleness', type=int, default=50, help='maximum number of steps a cached pseudo-label is reused; older ones are predicted again')
 
         return parser
 
@@ -54,6 +60,8 @@ class CycleGANModel(BaseModel):
         # specify the images you want to save/display. The training/test scripts will call <BaseModel.get_current_visuals>
         visual_names_A = ['real_A', 'fake_B', "real_gt_A", "fake_gt_A"]
         visual_names_B = ['real_B', 'fake_A', "real_gt_B", "fake_gt_B"]
+        if self.isTrain and opt.pseudo_label_refresh > 1:  # hit rate and mean age in steps of the cached pseudo-labels
+            self.loss_names += ['pl_hit', 'pl_stale']
         if self.isTrain and self.opt.lambda_identity > 0.0:  # if identity loss is used, we also visualize idt_B=G_A(B) ad idt_A=G_A(B)
             visual_names_A.append('idt_B')
             visual_names_B.append('idt_A')
@@ -87,15 +95,25 @@ class CycleGANModel(BaseModel):
             self.netD_Bc = networks.define_D(opt.input_nc, opt.ndf, opt.netD,
                                             opt.n_layers_D, opt.norm, opt.init_type, opt.init_gain, self.gpu_ids)
             
-        self.netC_A = networks.define_UNet(opt.A_domain_segmentor, opt.input_nc)
-        self.netC_B = networks.define_UNet(opt.B_domain_segmentor, opt.output_nc)
+        # frozen segmentors: no gradients, eval mode, on the model device; only the segmentation head d1 is used
+        self.netC_A = networks.define_UNet(opt.A_domain_segmentor, opt.input_nc, self.device, opt.segmentor_precision, heads=('d1',))
+        self.netC_B = networks.define_UNet(opt.B_domain_segmentor, opt.output_nc, self.device, opt.segmentor_precision, heads=('d1',))
          
         print("FUCKING OK")
+        # compiled views of the networks and of the tensor-only steps; the label masking of <forward> stays eager
+        self.run_G_A, self.run_G_B = networks.compile_net(self.netG_A, opt.compile_mode), networks.compile_net(self.netG_B, opt.compile_mode)
+        self.run_C_A, self.run_C_B = networks.compile_net(self.netC_A, opt.compile_mode), networks.compile_net(self.netC_B, opt.compile_mode)
+        self.run_translate = networks.compile_fn(self.translate, opt.compile_mode)
         if self.isTrain:
             if opt.lambda_identity > 0.0:  # only works when input and output images have the same number of channels
                 assert(opt.input_nc == opt.output_nc)
             self.fake_A_pool = ImagePool(opt.pool_size)  # create image buffer to store previously generated images
             self.fake_B_pool = ImagePool(opt.pool_size)  # create image buffer to store previously generated images
+            self.pseudo_label_A = self.pseudo_label_B = None
+            if opt.pseudo_label_refresh > 1:  # cached nuclei of fake A (keyed by the real B path) and fake B (keyed by the real A path)
+                assert self.deterministic_geometry(opt), '--pseudo_label_refresh needs samples loaded with the same geometry every time: --no_flip, no random crop, no slide patches and no geometric --batch_augment'
+                self.pseudo_label_A = PseudoLabelCache(opt.pseudo_label_refresh, opt.pseudo_label_staleness, opt.pseudo_label_mode)
+                self.pseudo_label_B = PseudoLabelCache(opt.pseudo_label_refresh, opt.pseudo_label_staleness, opt.pseudo_label_mode)
             # define loss functions
             self.criterionGAN = networks.GANLoss(opt.gan_mode).to(self.device)  # define GAN loss.
             self.criterionCycle = torch.nn.L1Loss()
@@ -106,6 +124,10 @@ class CycleGANModel(BaseModel):
             #self.optimizer_D = torch.optim.Adam(itertools.chain(self.netD_A.parameters(), self.netD_B.parameters()), lr=opt.lr, betas=(opt.beta1, 0.999))
             self.optimizers.append(self.optimizer_G)
             self.optimizers.append(self.optimizer_D)
+            self.run_D_A, self.run_D_B = networks.compile_net(self.netD_A, opt.compile_mode), networks.compile_net(self.netD_B, opt.compile_mode)
+            self.run_D_Ac, self.run_D_Bc = networks.compile_net(self.netD_Ac, opt.compile_mode), networks.compile_net(self.netD_Bc, opt.compile_mode)
+            self.run_generator_losses = networks.compile_fn(self.generator_losses, opt.compile_mode)
+            self.run_discriminator_loss = networks.compile_fn(self.discriminator_loss, opt.compile_mode)
 
     def set_input(self, input):
         """Unpack input data from the dataloader and perform necessary pre-processing steps.
@@ -114,98 +136,136 @@ class CycleGANModel(BaseModel):
         The option 'direction' can be used to swap domain A and domain B.
         """
         AtoB = self.opt.direction == 'AtoB'
-        self.real_A = input['A' if AtoB else 'B'].to(self.device)
-        self.real_B = input['B' if AtoB else 'A'].to(self.device)
-        self.real_gt_A_cell = input['A_gt_cell' if AtoB else 'B_gt_cell'].to(self.device)
-        self.real_gt_B_cell = input['B_gt_cell' if AtoB else 'A_gt_cell'].to(self.device)
-        self.real_gt_A_line = input['A_gt_line' if AtoB else 'B_gt_line'].to(self.device)
-        self.real_gt_B_line = input['B_gt_line' if AtoB else 'A_gt_line'].to(self.device)
+        self.real_A = self.to_input(input['A' if AtoB else 'B'])
+        self.real_B = self.to_input(input['B' if AtoB else 'A'])
+        self.real_gt_A_cell = self.to_label(input['A_gt_cell' if AtoB else 'B_gt_cell'])
+        self.real_gt_B_cell = self.to_label(input['B_gt_cell' if AtoB else 'A_gt_cell'])
+        self.real_gt_A_line = self.to_label(input['A_gt_line' if AtoB else 'B_gt_line'])
+        self.real_gt_B_line = self.to_label(input['B_gt_line' if AtoB else 'A_gt_line'])
         self.image_paths = input['A_paths' if AtoB else 'B_paths']
-        
+        self.image_paths_B = input['B_paths' if AtoB else 'A_paths']
+        self.line_range_A = self.line_range_B = None
+        self.edge_A = self.edge_B = None
+        if 'A_edge' in input:  # masked real images and fused labels from the data loader ('--precompute_partial')
+            self.real_gt_A = self.to_label(input['A_gt' if AtoB else 'B_gt'])
+            self.real_gt_B = self.to_label(input['B_gt' if AtoB else 'A_gt'])
+            self.real_A_cell = self.to_input(input['A_cell_img' if AtoB else 'B_cell_img'])
+            self.real_B_cell = self.to_input(input['B_cell_img' if AtoB else 'A_cell_img'])
+            self.edge_A = self.to_input(input['A_edge' if AtoB else 'B_edge'])
+            self.edge_B = self.to_input(input['B_edge' if AtoB else 'A_edge'])
+        self.visual_sizes = {}
+        if 'A_hw' in input:  # padded batch of '--size_buckets'; every visual is cropped to the size of the image it derives from
+            hw_A, hw_B = input['A_hw' if AtoB else 'B_hw'], input['B_hw' if AtoB else 'A_hw']
+            for name in ['real_A', 'fake_B', 'real_gt_A', 'fake_gt_B', 'rec_A', 'idt_A']:
+                self.visual_sizes[name] = hw_A
+            for name in ['real_B', 'fake_A', 'real_gt_B', 'fake_gt_A', 'rec_B', 'idt_B']:
+                self.visual_sizes[name] = hw_B
+        if 'A_line_min' in input:  # layer label ranges from the label statistics index ('--label_stats'), still on the host
+            self.line_range_A = self.batch_line_range(input, 'A' if AtoB else 'B')
+            self.line_range_B = self.batch_line_range(input, 'B' if AtoB else 'A')
+
+    def batch_line_range(self, input, domain):
+        """Return the normalized (min, max) of the layer labels of one domain of the batch.
+        The values are normalized with the same arithmetic as the label tensors, so they compare exactly equal.
+        With '--compact_labels', the raw uint8 values are returned. Ranges still on the host are returned as
+        Python floats; ranges already on the device ('--device_prefetch') stay 0-dim tensors, as reading them would sync.
+        """
+        mins = torch.as_tensor(input[domain + '_line_min'])
+        maxs = torch.as_tensor(input[domain + '_line_max'])
+        if not self.opt.compact_labels:
+            mins, maxs = normalize_batch(mins), normalize_batch(maxs)
+        if mins.device.type != 'cpu':
+            return mins.min(), maxs.max()
+        return mins.min().item(), maxs.max().item()
+
+    def layer_edges(self, line, line_range):
+        """Return the bool mask of the first and the last layer of a batch of layer labels.
+        The largest label is ignored if it is below 0, i.e. at most 127 for uint8 labels ('--compact_labels').
+        Without a <line_range> from '--label_stats', the batch min and max stay on the device and the test
+        is a tensor op, so no host sync is needed.
+        """
+        low, high = line_range if line_range is not None else (line.min(), line.max())
+        edge = line == low
+        has_high = high > 127 if line.dtype == torch.uint8 else high >= 0
+        if isinstance(has_high, torch.Tensor):
+            edge |= (line == high) & has_high
+        elif has_high:
+            edge |= line == high
+        return edge
+
+    @staticmethod
+    def deterministic_geometry(opt):
+        """Return whether every sample is loaded with the same crop and orientation every time, so cached per-sample predictions stay aligned.
+        Patches of '--dataset_mode slide' share the path of their slide, so they never qualify.
+        """
+        random_crop = 'crop' in opt.preprocess and not (opt.preprocess == 'resize_and_crop' and opt.load_size == opt.crop_size)
+        random_crop = random_crop or opt.dataset_mode == 'slide'
+        batch_geometry = set(opt.batch_augment.split(',')) & {'crop', 'flip', 'rot90'}
+        return opt.no_flip and not random_crop and not batch_geometry and getattr(opt, 'crops_per_sample', 1) == 1
+
+    def predict_cells(self, netC, fake, cache=None, keys=None):
+        """Return the nuclei the frozen segmentor <netC> predicts on a fake batch as a -1/1 float map like the real labels.
+        With a PseudoLabelCache <cache>, only the samples of <keys> it does not serve are segmented.
+        """
+        def segment(images):
+            cell_pred, _, _ = netC((images + 1) / 2)
+            return torch.argmax(cell_pred, dim=1, keepdim=True) == 1
+        mask = segment(fake) if cache is None else cache.query(segment, fake, keys)
+        return 2 * mask.to(dtype=torch.float) - 1
+
+    def translate(self, netG, image):
+        """Return the noisy input and the outputs of generator <netG> for a batch of images.
+        Uniform noise in [-1/18, 1/18] is drawn on the device of <image>, added to it and the result is clamped to [-1, 1] in place.
+        """
+        noisy = torch.rand_like(image).sub_(0.5).div_(9).add_(image).clamp_(-1, 1)
+        return noisy, netG(noisy)
+
+    def seg_target(self, label):
+        """Return a label batch as the normalized float target of <criterionSeg>."""
+        return normalize_batch(label) if label.dtype == torch.uint8 else label
 
     def forward(self):
         """Run forward pass; called by both functions <optimize_parameters> and <test>."""
 
-        batchsize, A_ch, h, w = self.real_A.size()
-        _, B_ch, _, _ = self.real_B.size()
-
-        # combline cell and line ground truth in A domain
-        self.real_gt_A = self.real_gt_A_line.clone()
-        self.real_gt_A[self.real_gt_A_cell==1]=1
-        # combline cell and line ground truth in B domain
-        self.real_gt_B = self.real_gt_B_line.clone()
-        self.real_gt_B[self.real_gt_B_cell==1]=1
+        nucleus = 255 if self.opt.compact_labels else 1  # label value of the nuclei: 255 in uint8 class maps, 1 in normalized labels
+        if self.edge_A is None:
+            # combline cell and line ground truth in A and B domain
+            self.real_gt_A = self.real_gt_A_line.masked_fill(self.real_gt_A_cell == nucleus, nucleus)
+            self.real_gt_B = self.real_gt_B_line.masked_fill(self.real_gt_B_cell == nucleus, nucleus)
         
         # real A --> fake B
-        noise = torch.rand(batchsize, A_ch, h, w).to(self.device)
-        self.noise_real_A = self.real_A + (noise-0.5)/9
-        self.noise_real_A[self.noise_real_A > 1] = 1
-        self.noise_real_A[self.noise_real_A < -1] = -1
-        self.fake_B, self.fake_B_seg = self.netG_A(self.noise_real_A)  # G_A(A)
+        self.noise_real_A, (self.fake_B, self.fake_B_seg) = self.run_translate(self.run_G_A, self.real_A)  # G_A(A)
         # real B --> fake A
-        noise = torch.rand(batchsize, B_ch, h, w).to(self.device)
-        self.noise_real_B = self.real_B + (noise-0.5)/9
-        self.noise_real_B[self.noise_real_B > 1] = 1
-        self.noise_real_B[self.noise_real_B < -1] = -1
-        self.fake_A, self.fake_A_seg = self.netG_B(self.noise_real_B)  # G_B(B)
+        self.noise_real_B, (self.fake_A, self.fake_A_seg) = self.run_translate(self.run_G_B, self.real_B)  # G_B(B)
         
         # predict the cell nuclei of fake A image
-        cell_pred_A_temp, _ , _ = self.netC_A((self.fake_A+1)/2)
-        self.cell_pred_A = 2*(torch.unsqueeze(torch.argmax(cell_pred_A_temp, dim=1),1).to(dtype = torch.float))-1
+        cache_A, cache_B = (self.pseudo_label_A, self.pseudo_label_B) if self.isTrain else (None, None)
+        self.cell_pred_A = self.predict_cells(self.run_C_A, self.fake_A, cache_A, self.image_paths_B)
 
         # predict the cell nuclei of fake B image
-        cell_pred_B_temp, _ , _ = self.netC_B((self.fake_B+1)/2)
-        self.cell_pred_B = 2*(torch.unsqueeze(torch.argmax(cell_pred_B_temp, dim=1),1).to(dtype = torch.float))-1
-        
-        # combline cell prediction and line ground truth in A domain
-        self.fake_gt_A = self.real_gt_B_line.clone()
-        self.fake_gt_A[self.cell_pred_A==1]=1
-        # combline cell prediction and line ground truth in B domain
-        self.fake_gt_B = self.real_gt_A_line.clone()
-        self.fake_gt_B[self.cell_pred_B==1]=1
+        self.cell_pred_B = self.predict_cells(self.run_C_B, self.fake_B, cache_B, self.image_paths)
+        if cache_A is not None:
+            self.loss_pl_hit = (cache_A.hit_rate + cache_B.hit_rate) / 2
+            self.loss_pl_stale = (cache_A.staleness + cache_B.staleness) / 2
         
+        # combline cell prediction and line ground truth in A and B domain
+        self.fake_gt_A = self.real_gt_B_line.masked_fill(self.cell_pred_A == 1, nucleus)
+        self.fake_gt_B = self.real_gt_A_line.masked_fill(self.cell_pred_B == 1, nucleus)
         
         # fake B --> rec A
-        noise = torch.rand(batchsize, B_ch, h, w).to(self.device)
-        self.noise_fake_B = self.fake_B + (noise-0.5)/9
-        self.noise_fake_B[self.noise_fake_B > 1] = 1
-        self.noise_fake_B[self.noise_fake_B < -1] = -1
-        self.rec_A, self.rec_A_seg = self.netG_B(self.noise_fake_B)   # G_B(G_A(A))
+        self.noise_fake_B, (self.rec_A, self.rec_A_seg) = self.run_translate(self.run_G_B, self.fake_B)   # G_B(G_A(A))
         # fake A --> rec B
-        noise = torch.rand(batchsize, A_ch, h, w).to(self.device)
-        self.noise_fake_A = self.fake_A + (noise-0.5)/9
-        self.noise_fake_A[self.noise_fake_A > 1] = 1
-        self.noise_fake_A[self.noise_fake_A < -1] = -1
-        self.rec_B, self.rec_B_seg = self.netG_A(self.noise_fake_A)   # G_A(G_B(B))
-        
-        B_MIN = self.real_gt_B_line.min()
-        B_MAX = self.real_gt_B_line.max()
-        A_MIN = self.real_gt_A_line.min()
-        A_MAX = self.real_gt_A_line.max()
-        
-        if(B_MAX<0):
-            B_MAX = 2
-        if(A_MAX<0):
-            A_MAX = 2
-        
-        # partial real B
-        self.real_B_cell = self.real_B.clone()
-        self.real_B_cell[(self.real_gt_B_cell==1) | (self.real_gt_B_line==B_MIN) | (self.real_gt_B_line==B_MAX)] = -1
-        # partial fake B
-        self.fake_B_cell = self.fake_B.clone()
-        self.fake_B_cell[(self.cell_pred_B==1) | (self.real_gt_A_line==A_MIN) | (self.real_gt_A_line==A_MAX)] = -1
-  
-        # partial real A
-        self.real_A_cell = self.real_A.clone()
-        self.real_gt_A_line = torch.cat((self.real_gt_A_line,self.real_gt_A_line,self.real_gt_A_line), dim=1)
-        self.real_gt_A_cell = torch.cat((self.real_gt_A_cell,self.real_gt_A_cell,self.real_gt_A_cell), dim=1)
-        self.real_A_cell[(self.real_gt_A_cell==1) | (self.real_gt_A_line==A_MIN) | (self.real_gt_A_line==A_MAX)] = -1
-        
-        # partial fake A
-        self.fake_A_cell = self.fake_A.clone()
-        self.real_gt_B_line = torch.cat((self.real_gt_B_line,self.real_gt_B_line,self.real_gt_B_line), dim=1)
-        self.cell_pred_A = torch.cat((self.cell_pred_A,self.cell_pred_A,self.cell_pred_A), dim=1)
-        self.fake_A_cell[(self.cell_pred_A==1) | (self.real_gt_B_line==B_MIN) | (self.real_gt_B_line==B_MAX)] = -1
+        self.noise_fake_A, (self.rec_B, self.rec_B_seg) = self.run_translate(self.run_G_A, self.fake_A)   # G_A(G_B(B))
+
+        if self.edge_A is None:  # bool masks of the first and the last layer, broadcast over the image channels
+            self.edge_A = self.layer_edges(self.real_gt_A_line, self.line_range_A)
+            self.edge_B = self.layer_edges(self.real_gt_B_line, self.line_range_B)
+            # partial real A and B
+            self.real_A_cell = self.real_A.masked_fill((self.real_gt_A_cell == nucleus) | self.edge_A, -1)
+            self.real_B_cell = self.real_B.masked_fill((self.real_gt_B_cell == nucleus) | self.edge_B, -1)
+        # partial fake B and A
+        self.fake_B_cell = self.fake_B.masked_fill((self.cell_pred_B==1) | self.edge_A, -1)
+        self.fake_A_cell = self.fake_A.masked_fill((self.cell_pred_A==1) | self.edge_B, -1)
 
     def backward_D_basic(self, netD, real, fake):
         """Calculate GAN loss for the discriminator
@@ -216,67 +276,77 @@ class CycleGANModel(BaseModel):
         Return the discriminator loss.
         We also call loss_D.backward() to calculate the gradients.
         """
+        loss_D = self.run_discriminator_loss(netD, real, fake.detach())
+        loss_D.backward()
+        return loss_D
+
+    def discriminator_loss(self, netD, real, fake):
+        """Return the GAN loss of discriminator <netD> for a batch of real and a batch of (detached) fake images."""
         # Real
         pred_real = netD(real)
         loss_D_real = self.criterionGAN(pred_real, True) 
         # Fake
-        pred_fake = netD(fake.detach())
+        pred_fake = netD(fake)
         loss_D_fake = self.criterionGAN(pred_fake, False) 
-        # Combined loss and calculate gradients
-        loss_D = (loss_D_real + loss_D_fake) * 0.5
-        loss_D.backward()
-        return loss_D
+        # Combined loss
+        return (loss_D_real + loss_D_fake) * 0.5
 
     def backward_D_A(self):
         """Calculate GAN loss for discriminator D_A"""
-        self.loss_D_A = self.backward_D_basic(self.netD_A, self.real_B, self.fake_B)
+        self.loss_D_A = self.backward_D_basic(self.run_D_A, self.real_B, self.fake_B)
 
     def backward_D_B(self):
         """Calculate GAN loss for discriminator D_B"""
-        self.loss_D_B = self.backward_D_basic(self.netD_B, self.real_A, self.fake_A)
+        self.loss_D_B = self.backward_D_basic(self.run_D_B, self.real_A, self.fake_A)
         
     def backward_D_Ac(self):
         """Calculate GAN loss for discriminator D_A"""
-        self.loss_D_Ac = self.backward_D_basic(self.netD_Ac, self.real_B_cell, self.fake_B_cell)
+        self.loss_D_Ac = self.backward_D_basic(self.run_D_Ac, self.real_B_cell, self.fake_B_cell)
 
     def backward_D_Bc(self):
         """Calculate GAN loss for discriminator D_B"""
-        self.loss_D_Bc = self.backward_D_basic(self.netD_Bc, self.real_A_cell, self.fake_A_cell)
+        self.loss_D_Bc = self.backward_D_basic(self.run_D_Bc, self.real_A_cell, self.fake_A_cell)
     
 
     def backward_G(self):
         """Calculate the loss for generators G_A and G_B"""
-        lambda_idt = self.opt.lambda_identity
+        (self.loss_G_A, self.loss_G_B, self.loss_cycle_A, self.loss_cycle_B, self.loss_seg_A, self.loss_seg_B,
+         self.loss_rec_A, self.loss_rec_B, self.loss_G_Ac, self.loss_G_Bc) = self.run_generator_losses()
+
+        # All together
+        self.loss_G1 = self.loss_G_A + self.loss_G_B + self.loss_cycle_A + self.loss_cycle_B
+        self.loss_G2 = self.loss_seg_A + self.loss_seg_B + self.loss_rec_A + self.loss_rec_B 
+        self.loss_G3 = self.loss_G_Ac + self.loss_G_Bc 
+        
+        self.loss_G = self.loss_G1 + self.loss_G2 + self.loss_G3
+        self.loss_G.backward()
+
+    def generator_losses(self):
+        """Return the losses (G_A, G_B, cycle_A, cycle_B, seg_A, seg_B, rec_A, rec_B, G_Ac, G_Bc) of the generators for the current forward pass."""
         lambda_A = self.opt.lambda_A
         lambda_B = self.opt.lambda_B
         
         # GAN loss
-        self.loss_G_A = self.criterionGAN(self.netD_A(self.fake_B), True)
-        self.loss_G_B = self.criterionGAN(self.netD_B(self.fake_A), True)
+        loss_G_A = self.criterionGAN(self.run_D_A(self.fake_B), True)
+        loss_G_B = self.criterionGAN(self.run_D_B(self.fake_A), True)
 
         # Cycle-consistency loss
-        self.loss_cycle_A = self.criterionCycle(self.rec_A, self.real_A) * lambda_A
-        self.loss_cycle_B = self.criterionCycle(self.rec_B, self.real_B) * lambda_B
+        loss_cycle_A = self.criterionCycle(self.rec_A, self.real_A) * lambda_A
+        loss_cycle_B = self.criterionCycle(self.rec_B, self.real_B) * lambda_B
         
         # Supervised loss
-        self.loss_seg_A = self.criterionSeg(self.fake_A_seg, self.fake_gt_A) * lambda_A
-        self.loss_seg_B = self.criterionSeg(self.fake_B_seg, self.fake_gt_B) * lambda_B
+        loss_seg_A = self.criterionSeg(self.fake_A_seg, self.seg_target(self.fake_gt_A)) * lambda_A
+        loss_seg_B = self.criterionSeg(self.fake_B_seg, self.seg_target(self.fake_gt_B)) * lambda_B
 
         # Cycle-consistency label loss
-        self.loss_rec_A = self.criterionSeg(self.rec_A_seg, self.real_gt_A) * lambda_A
-        self.loss_rec_B = self.criterionSeg(self.rec_B_seg, self.real_gt_B) * lambda_B
+        loss_rec_A = self.criterionSeg(self.rec_A_seg, self.seg_target(self.real_gt_A)) * lambda_A
+        loss_rec_B = self.criterionSeg(self.rec_B_seg, self.seg_target(self.real_gt_B)) * lambda_B
         
         # Partial GAN loss
-        self.loss_G_Ac = self.criterionGAN(self.netD_Ac(self.fake_B_cell), True) 
-        self.loss_G_Bc = self.criterionGAN(self.netD_Bc(self.fake_A_cell), True)
+        loss_G_Ac = self.criterionGAN(self.run_D_Ac(self.fake_B_cell), True) 
+        loss_G_Bc = self.criterionGAN(self.run_D_Bc(self.fake_A_cell), True)
 
-        # All together
-        self.loss_G1 = self.loss_G_A + self.loss_G_B + self.loss_cycle_A + self.loss_cycle_B
-        self.loss_G2 = self.loss_seg_A + self.loss_seg_B + self.loss_rec_A + self.loss_rec_B 
-        self.loss_G3 = self.loss_G_Ac + self.loss_G_Bc 
-        
-        self.loss_G = self.loss_G1 + self.loss_G2 + self.loss_G3
-        self.loss_G.backward()
+        return loss_G_A, loss_G_B, loss_cycle_A, loss_cycle_B, loss_seg_A, loss_seg_B, loss_rec_A, loss_rec_B, loss_G_Ac, loss_G_Bc
 
     def optimize_parameters(self):
         """Calculate losses, gradients, and update network weights; called in every training iteration"""
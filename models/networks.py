@@ -113,6 +113,45 @@ def init_net(net, init_type='normal', init_gain=0.02, gpu_ids=[]):
     return net
 
 
+def compile_net(net, mode='none'):
+    """Return a compiled callable of a network that shares its parameters and train/eval mode
+    Parameters:
+        net (network) -- the network to be compiled
+        mode (str)    -- none | compile | script: torch.compile, or TorchScript (also where torch.compile is not available)
+    The network itself is left as it is, so saving, loading and <set_requires_grad> work on it unchanged.
+    Networks that TorchScript cannot compile run eagerly.
+    """
+    if mode == 'compile' and hasattr(torch, 'compile'):
+        return torch.compile(net)
+    if mode in ['compile', 'script']:
+        try:
+            scripted = torch.jit.script(net)
+        except Exception as e:
+            print('TorchScript cannot compile %s, it runs eagerly: %s' % (type(net).__name__, str(e).splitlines()[0]))
+            return net
+
+        def run(*inputs):
+            if scripted.training != net.training:  # <BaseModel.eval> only switches the original network
+                scripted.train(net.training)
+            return scripted(*inputs)
+        return run
+    if mode != 'none':
+        raise NotImplementedError('compile mode [%s] is not recognized' % mode)
+    return net
+
+
+def compile_fn(fn, mode='none'):
+    """Return a function of tensors compiled with torch.compile for --compile_mode compile
+    Parameters:
+        fn (function) -- the function to be compiled, e.g. a bound method of a model
+        mode (str)    -- none | compile | script
+    TorchScript cannot compile methods that read their model's attributes, so <fn> runs eagerly with script.
+    """
+    if mode == 'compile' and hasattr(torch, 'compile'):
+        return torch.compile(fn)
+    return fn
+
+
 def define_G(input_nc, output_nc, ngf, netG, norm='batch', use_dropout=False, init_type='normal', init_gain=0.02, gpu_ids=[]):
     """Create a generator
     Parameters:
@@ -187,11 +226,62 @@ def define_D(input_nc, ndf, netD, n_layers_D=3, norm='batch', init_type='normal'
         raise NotImplementedError('Discriminator model name [%s] is not recognized' % netD)
     return init_net(net, init_type, init_gain, gpu_ids)
 
-def define_UNet(modelpath,img_ch):
+def define_UNet(modelpath, img_ch, device=torch.device('cpu'), precision='fp32', heads=('d1', 'dm', 'da')):
+    """Load a pretrained segmentor for inference
+    Parameters:
+        modelpath (str)       -- path to the state dict of the Optim_U_Net
+        img_ch (int)          -- the number of channels of the images it segments
+        device (torch.device) -- the device the segmentor runs on: CPU or GPU
+        precision (str)       -- the precision of its weights and activations: fp32 | fp16 | bf16
+        heads (str tuple)     -- the outputs to compute: d1 (segmentation) | dm (1/2 scale) | da (auxiliary); see Optim_U_Net
+    Returns a FrozenSegmentor, i.e. a network with frozen weights that always runs in eval mode without autograd.
+    """
     model = Optim_U_Net(img_ch=img_ch,output_ch=2)
-    model.load_state_dict(torch.load(modelpath))
-    model = model.cuda()
-    return model
+    model.load_state_dict(torch.load(modelpath, map_location='cpu'))
+    if precision == 'fp16' and device.type == 'cpu':
+        raise NotImplementedError('segmentor precision [fp16] needs a GPU; use bf16 on the CPU')
+    return FrozenSegmentor(model, precision, heads).to(device)
+
+
+class FrozenSegmentor(nn.Module):
+    """Run a pretrained segmentor for inference only.
+    The weights are frozen, the normalization layers always run in eval mode and no autograd graph is
+    recorded, so none of the segmentor's activations are kept for the backward pass. The predictions
+    are only used through argmax, which carries no gradient anyway. The weights and activations can
+    be kept in half precision; the outputs are returned as float32. Only the requested <heads> are
+    computed, the others are returned as None.
+    """
+
+    precisions = {'fp32': torch.float32, 'fp16': torch.float16, 'bf16': torch.bfloat16}
+
+    def __init__(self, net, precision='fp32', heads=('d1', 'dm', 'da')):
+        """Initialize the FrozenSegmentor class.
+        Parameters:
+            net (nn.Module)    -- the pretrained segmentor
+            precision (str)    -- the precision of its weights and activations: fp32 | fp16 | bf16
+            heads (str tuple)  -- the outputs to compute, passed to the forward of <net>
+        """
+        super(FrozenSegmentor, self).__init__()
+        if precision not in self.precisions:
+            raise NotImplementedError('segmentor precision [%s] is not recognized' % precision)
+        self.dtype = self.precisions[precision]
+        self.heads = tuple(heads)
+        self.net = net.to(self.dtype)
+        for param in self.net.parameters():
+            param.requires_grad = False
+        self.train(False)
+
+    def train(self, mode=True):
+        """Stay in eval mode whatever mode the caller asks for."""
+        return super(FrozenSegmentor, self).train(False)
+
+    def forward(self, input):
+        """Standard forward; returns the outputs of the segmentor as float32 tensors without gradients.
+        torch.no_grad() rather than torch.inference_mode(): the outputs are used to build masks of tensors that require gradients.
+        """
+        with torch.no_grad():
+            outputs = self.net(input.to(self.dtype), heads=self.heads)
+        return tuple(None if output is None else output.float() for output in outputs)
 
 
 class GANLoss(nn.Module):
@@ -694,7 +784,14 @@ class Optim_U_Net(nn.Module):
         
         self.Conv_AxA = nn.Conv2d(filter_size,3,kernel_size=1,stride=1,padding=0)
         
-    def forward(self,x):
+    heads = ('d1', 'dm', 'da')
+
+    def forward(self,x,heads=heads):
+        """Standard forward; returns the outputs (d1, dm, da) of the segmentation, the 1/2 scale and the auxiliary head.
+        Only the heads listed in <heads> are computed; the others are returned as None, and the decoder
+        branches that only they need (Conv_2x2, UpS1/UpS2 and the second Up_conv4/Up_conv2 pass, Conv_AxA,
+        or the full-resolution stages of d1) are never executed.
+        """
         # encoding path
         
         x1 = self.Conv1(x) 
@@ -711,34 +808,39 @@ class Optim_U_Net(nn.Module):
         x5 = self.Maxpool(x4)
         x5 = self.Conv5(x5)
         
-        d5 = self.Up5(x5)
-        d5 = torch.cat((x4,d5),dim=1)
-        d5 = self.Up_conv5(d5)
-        
-        d4 = self.Up4(d5)
-        d4 = torch.cat((x3,d4),dim=1)
-        d4 = self.Up_conv4(d4)
- 
-        d3 = self.Up3(d4)
-        d3 = torch.cat((x2,d3),dim=1)
-        d3 = self.Up_conv3(d3)
-
-        d2 = self.Up2(d3)
-        d2 = torch.cat((x1,d2),dim=1)
-        d2 = self.Up_conv2(d2)
-        
-        d1 = self.Conv_1x1(d2)
-        dm = self.Conv_2x2(d3)
-        
-        dl = self.UpS1(x5)
-        dl = torch.cat((x3,dl),dim=1)
-        dl = self.Up_conv4(dl)
-
-        dl = self.UpS2(dl)
-        dl = torch.cat((x1,dl),dim=1)
-        dl = self.Up_conv2(dl)
+        d1 = dm = da = None
+        if 'd1' in heads or 'dm' in heads:
+            d5 = self.Up5(x5)
+            d5 = torch.cat((x4,d5),dim=1)
+            d5 = self.Up_conv5(d5)
+            
+            d4 = self.Up4(d5)
+            d4 = torch.cat((x3,d4),dim=1)
+            d4 = self.Up_conv4(d4)
+     
+            d3 = self.Up3(d4)
+            d3 = torch.cat((x2,d3),dim=1)
+            d3 = self.Up_conv3(d3)
+
+            if 'd1' in heads:
+                d2 = self.Up2(d3)
+                d2 = torch.cat((x1,d2),dim=1)
+                d2 = self.Up_conv2(d2)
+                
+                d1 = self.Conv_1x1(d2)
+            if 'dm' in heads:
+                dm = self.Conv_2x2(d3)
         
-        da = self.Conv_AxA(dl)
+        if 'da' in heads:
+            dl = self.UpS1(x5)
+            dl = torch.cat((x3,dl),dim=1)
+            dl = self.Up_conv4(dl)
+
+            dl = self.UpS2(dl)
+            dl = torch.cat((x1,dl),dim=1)
+            dl = self.Up_conv2(dl)
+            
+            da = self.Conv_AxA(dl)
         
         return d1, dm, da
 
@@ -50,8 +50,10 @@ class TestModel(BaseModel):
             input: a dictionary that contains the data itself and its metadata information.
         We need to use 'single_dataset' dataset mode. It only load images from one domain.
         """
-        self.real = input['A'].to(self.device)
+        self.real = self.to_input(input['A'])
         self.image_paths = input['A_paths']
+        if 'A_hw' in input:  # padded batch of '--size_buckets'
+            self.visual_sizes = {'real': input['A_hw'], 'fake': input['A_hw']}
 
     def forward(self):
         """Run forward pass."""
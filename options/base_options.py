@@ -39,8 +39,9 @@ class BaseOptions():
         parser.add_argument('--no_dropout', action='store_true', help='no dropout for the generator')
         parser.add_argument('--A_domain_segmentor', type=str, default='A_domain U-Net path', help='path to your A domain U-Net segmentation model')
         parser.add_argument('--B_domain_segmentor', type=str, default='B_domain U-Net path', help='path to your B domain U-Net segmentation model')
+        parser.add_argument('--segmentor_precision', type=str, default='fp32', help='precision of the frozen segmentors [fp32 | fp16 | bf16]; fp16 needs a GPU')
         # dataset parameters
-        parser.add_argument('--dataset_mode', type=str, default='unaligned', help='chooses how datasets are loaded. [unaligned | aligned | single | colorization]')
+        parser.add_argument('--dataset_mode', type=str, default='unaligned', help='chooses how datasets are loaded. [unaligned | shard | tar | slide | stream | aligned | single | colorization]')
         parser.add_argument('--direction', type=str, default='AtoB', help='AtoB or BtoA')
         parser.add_argument('--serial_batches', action='store_true', help='if true, takes images in order to make batches, otherwise takes them randomly')
         parser.add_argument('--num_threads', default=4, type=int, help='# threads for loading data')
@@ -50,6 +51,19 @@ class BaseOptions():
         parser.add_argument('--max_dataset_size', type=int, default=float("inf"), help='Maximum number of samples allowed per dataset. If the dataset directory contains more than max_dataset_size, only a subset is loaded.')
         parser.add_argument('--preprocess', type=str, default='resize_and_crop', help='scaling and cropping of images at load time [resize_and_crop | crop | scale_width | scale_width_and_crop | none]')
         parser.add_argument('--no_flip', action='store_true', help='if specified, do not flip the images for data augmentation')
+        parser.add_argument('--batch_augment', type=str, default='', help='comma-separated augmentations applied to whole training batches after collation [crop,flip,rot90,jitter]; see data/batch_augment.py')
+        parser.add_argument('--intensity_jitter', type=float, default=0.1, help='maximum relative brightness and contrast change of --batch_augment jitter')
+        parser.add_argument('--decoder', type=str, default='pil', help='image decoding backend [pil | pil_draft | cv2 | turbojpeg]; see data/decoders.py')
+        parser.add_argument('--uint8_batches', action='store_true', help='load and collate images as uint8 and normalize them once per batch on the device')
+        parser.add_argument('--device_prefetch', type=int, default=0, help='if > 0, number of batches a background thread moves to the device ahead of the current step')
+        parser.add_argument('--infinite_sampler', action='store_true', help='keep the data loading workers alive for the whole run and draw samples from one endless stream; epochs become logical boundaries')
+        parser.add_argument('--sampler_seed', type=int, default=0, help='seed of the shuffling order of --infinite_sampler')
+        parser.add_argument('--size_buckets', action='store_true', help='batch only images of the same size and pad each batch to a multiple of 4, e.g. for [scale_width] or batched testing of variable-size images')
+        parser.add_argument('--prefetch_factor', type=int, default=2, help='number of batches loaded in advance by each data loading worker (by all threads with --loader_backend thread)')
+        parser.add_argument('--compact_labels', action='store_true', help='keep the cell and layer labels as uint8 class maps up to the losses instead of normalized float tensors')
+        parser.add_argument('--precompute_partial', action='store_true', help='compute the masked real images and fused labels of the cycle_gan model in the data loader instead of every forward pass')
+        parser.add_argument('--batch_ring', action='store_true', help='let the workers collate into a fixed ring of shared-memory batch slots of --batch_size x --crop_size x --crop_size; see data/batch_ring.py')
+        parser.add_argument('--loader_backend', type=str, default='process', help='load data with --num_threads worker processes or with a pool of --num_threads threads [process | thread]; see data/thread_loader.py')
         parser.add_argument('--display_winsize', type=int, default=256, help='display window size for both visdom and HTML')
         # additional parameters
         parser.add_argument('--epoch', type=str, default='latest', help='which epoch to load? set to latest to use latest cached model')
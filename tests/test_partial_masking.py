@@ -0,0 +1,117 @@
+"""Check that the partial images and fused labels of the cycle_gan model match the original masking.
+
+The baseline below is the masking of the original <CycleGANModel.forward>: clone, boolean index
+assignment, torch.cat of the labels to three channels and the B_MAX < 0 fallback. It is compared
+with the masked_fill path of <forward> and with the labels precomputed by <add_partial_images>
+('--precompute_partial'), for float and uint8 ('--uint8_batches', '--compact_labels') batches.
+The generators and segmentors are replaced by fixed random outputs, so only the masking is tested.
+
+Run with 'python -m pytest tests'.
+"""
+import argparse
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from data.base_dataset import add_partial_images, normalize_batch  # noqa: E402
+from models.cycle_gan_model import CycleGANModel  # noqa: E402
+
+
+def random_batch(n=2, size=16, layers=(0, 85, 170, 255), seed=0):
+    """Return a uint8 batch in the layout of the unaligned dataset; the layer labels take values of <layers>."""
+    generator = torch.Generator().manual_seed(seed)
+    batch = {'A': torch.randint(0, 256, (n, 3, size, size), dtype=torch.uint8, generator=generator),
+             'B': torch.randint(0, 256, (n, 1, size, size), dtype=torch.uint8, generator=generator),
+             'A_paths': ['A_%d' % i for i in range(n)], 'B_paths': ['B_%d' % i for i in range(n)]}
+    layers = torch.tensor(layers, dtype=torch.uint8)
+    for domain in ['A', 'B']:
+        cell = torch.randint(0, 10, (n, 1, size, size), generator=generator) == 0
+        batch[domain + '_gt_cell'] = cell.to(torch.uint8) * 255
+        batch[domain + '_gt_line'] = layers[torch.randint(0, len(layers), (n, 1, size, size), generator=generator)]
+    return batch
+
+
+def random_outputs(batch, seed=1):
+    """Return fixed fake images and -1/1 nuclei predictions for the generators and segmentors."""
+    generator = torch.Generator().manual_seed(seed)
+    n, _, h, w = batch['A'].shape
+    fake_A = torch.rand(n, 3, h, w, generator=generator) * 2 - 1
+    fake_B = torch.rand(n, 1, h, w, generator=generator) * 2 - 1
+    cell_pred_A = (torch.rand(n, 1, h, w, generator=generator) > 0.8).float() * 2 - 1
+    cell_pred_B = (torch.rand(n, 1, h, w, generator=generator) > 0.8).float() * 2 - 1
+    return fake_A, fake_B, cell_pred_A, cell_pred_B
+
+
+def baseline_masking(batch, fake_A, fake_B, cell_pred_A, cell_pred_B):
+    """Return real_A_cell, fake_B_cell, real_gt_A and fake_gt_A as computed by the original forward pass."""
+    real_A, real_B = normalize_batch(batch['A']), normalize_batch(batch['B'])
+    real_gt_A_cell, real_gt_A_line = normalize_batch(batch['A_gt_cell']), normalize_batch(batch['A_gt_line'])
+    real_gt_B_line = normalize_batch(batch['B_gt_line'])
+
+    real_gt_A = real_gt_A_line.clone()
+    real_gt_A[real_gt_A_cell == 1] = 1
+    fake_gt_A = real_gt_B_line.clone()
+    fake_gt_A[cell_pred_A == 1] = 1
+
+    A_MIN = real_gt_A_line.min()
+    A_MAX = real_gt_A_line.max()
+    if(A_MAX < 0):
+        A_MAX = 2
+
+    fake_B_cell = fake_B.clone()
+    fake_B_cell[(cell_pred_B == 1) | (real_gt_A_line == A_MIN) | (real_gt_A_line == A_MAX)] = -1
+    real_A_cell = real_A.clone()
+    real_gt_A_line = torch.cat((real_gt_A_line, real_gt_A_line, real_gt_A_line), dim=1)
+    real_gt_A_cell = torch.cat((real_gt_A_cell, real_gt_A_cell, real_gt_A_cell), dim=1)
+    real_A_cell[(real_gt_A_cell == 1) | (real_gt_A_line == A_MIN) | (real_gt_A_line == A_MAX)] = -1
+    return {'real_A_cell': real_A_cell, 'fake_B_cell': fake_B_cell, 'real_gt_A': real_gt_A, 'fake_gt_A': fake_gt_A}
+
+
+def model_masking(batch, fake_A, fake_B, cell_pred_A, cell_pred_B, compact_labels):
+    """Return real_A_cell, fake_B_cell, real_gt_A and fake_gt_A as computed by <set_input> and <forward>."""
+    model = CycleGANModel.__new__(CycleGANModel)  # no networks; the generators and segmentors are replaced below
+    model.opt = argparse.Namespace(direction='AtoB', compact_labels=compact_labels)
+    model.device = torch.device('cpu')
+    model.isTrain = False
+    model.run_G_A = lambda image: (fake_B, None)
+    model.run_G_B = lambda image: (fake_A, None)
+    model.run_C_A = model.run_C_B = None
+    model.run_translate = lambda netG, image: (image, netG(image))
+    model.predict_cells = lambda netC, fake, cache, keys: cell_pred_A if fake is fake_A else cell_pred_B
+    model.set_input(batch)
+    model.forward()
+    outputs = {name: getattr(model, name) for name in ['real_A_cell', 'fake_B_cell', 'real_gt_A', 'fake_gt_A']}
+    return {name: normalize_batch(value) if value.dtype == torch.uint8 else value for name, value in outputs.items()}
+
+
+def float_batch(batch):
+    """Return the batch as the float tensors of the default collate function."""
+    return {key: normalize_batch(value) if isinstance(value, torch.Tensor) else value for key, value in batch.items()}
+
+
+@pytest.mark.parametrize('layers', [(0, 85, 170, 255), (0, 64, 127)], ids=['max_above_0', 'max_below_0'])
+@pytest.mark.parametrize('precompute', [False, True], ids=['forward', 'precompute_partial'])
+@pytest.mark.parametrize('dtype', ['float', 'uint8', 'compact'])
+def test_partial_masking_matches_baseline(dtype, precompute, layers):
+    batch = random_batch(layers=layers)
+    outputs = random_outputs(batch)
+    expected = baseline_masking(batch, *outputs)
+    if dtype == 'float':
+        batch = float_batch(batch)
+    elif dtype == 'compact':  # uint8 class maps, float images
+        batch = dict(float_batch(batch), **{key: batch[key] for key in ['A_gt_cell', 'B_gt_cell', 'A_gt_line', 'B_gt_line']})
+    if precompute:
+        batch = add_partial_images(batch)
+    actual = model_masking(batch, *outputs, compact_labels=dtype == 'compact')
+    for name in expected:
+        assert actual[name].dtype == expected[name].dtype, name
+        assert torch.equal(actual[name], expected[name]), name
+
+
+def test_baseline_ignores_negative_max():
+    """The batch of the second layer set has its largest normalized layer label below 0, so only the smallest one is an edge."""
+    batch = random_batch(layers=(0, 64, 127))
+    line = normalize_batch(batch['A_gt_line'])
+    assert line.max() < 0
+    real_A_cell = baseline_masking(batch, *random_outputs(batch))['real_A_cell']
+    assert (real_A_cell[(line == line.max()).expand_as(real_A_cell) & (batch['A_gt_cell'] == 0).expand_as(real_A_cell)] != -1).any()
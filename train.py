@@ -34,6 +34,7 @@ if __name__ == '__main__':
     model.setup(opt)               # regular setup: load and print networks; create schedulers
     visualizer = Visualizer(opt)   # create a visualizer that display/save images and plots
     total_iters = 0                # the total number of training iterations
+    step_size = opt.batch_size * getattr(opt, 'crops_per_sample', 1)  # samples per full batch
 
     for epoch in range(opt.epoch_count, opt.n_epochs + opt.n_epochs_decay + 1):    # outer loop for different epochs; we save the model by <epoch_count>, <epoch_count>+<save_latest_freq>
         epoch_start_time = time.time()  # timer for entire epoch
@@ -46,19 +47,21 @@ if __name__ == '__main__':
             if total_iters % opt.print_freq == 0:
                 t_data = iter_start_time - iter_data_time
 
-            total_iters += opt.batch_size
-            epoch_iter += opt.batch_size
+            batch_len = len(data['A'])  # the last batch of an epoch may be smaller
+            total_iters += step_size    # full steps keep the counters on multiples of the print/display/save frequencies
+            epoch_iter += step_size
             model.set_input(data)         # unpack data from dataset and apply preprocessing
+            dataset.release(data)         # the batch was copied to the model; its '--batch_ring' slot can be refilled
             model.optimize_parameters()   # calculate loss functions, get gradients, update network weights
 
             if total_iters % opt.display_freq == 0:   # display images on visdom and save images to a HTML file
                 save_result = total_iters % opt.update_html_freq == 0
                 model.compute_visuals()
-                visualizer.display_current_results(model.get_current_visuals(), epoch, save_result)
+                visualizer.display_current_results(model.get_sample_visuals(0), epoch, save_result)
 
             if total_iters % opt.print_freq == 0:    # print training losses and save logging information to the disk
                 losses = model.get_current_losses()
-                t_comp = (time.time() - iter_start_time) / opt.batch_size
+                t_comp = (time.time() - iter_start_time) / batch_len
                 visualizer.print_current_losses(epoch, epoch_iter, losses, t_comp, t_data)
                 if opt.display_id > 0:
                     visualizer.plot_current_losses(epoch, float(epoch_iter) / dataset_size, losses)
@@ -75,3 +78,5 @@ if __name__ == '__main__':
             model.save_networks(epoch)
 
         print('End of epoch %d / %d \t Time Taken: %d sec' % (epoch, opt.n_epochs + opt.n_epochs_decay, time.time() - epoch_start_time))
+        if getattr(dataset.dataset, 'cache', None) is not None:  # shared decoded-sample cache (--sample_cache_mb)
+            print('sample cache: %(cached)d cached, %(hits)d hits, %(misses)d misses (hit rate %(hit_rate).3f), %(evictions)d evictions' % dataset.dataset.cache.stats())
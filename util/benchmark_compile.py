@@ -0,0 +1,85 @@
+"""Compare the compile modes of the cycle_gan model ('--compile_mode') on synthetic batches.
+
+For every mode, it creates the model with the given training options, runs '--steps' training
+steps on one random batch and reports the time of the first steps, which include compilation, and
+the median time of the remaining steady-state steps with its speedup over the first mode ('none'
+by default). The segmentors get random weights unless '--A_domain_segmentor'/'--B_domain_segmentor'
+point to existing files. Without '--gpu_ids', the benchmark runs on the CPU.
+
+Example:
+    python -m util.benchmark_compile --crop_size 256 --batch_size 1 --modes none compile script
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import torch
+from options.train_options import TrainOptions
+from models import create_model
+from models.networks import Optim_U_Net
+
+
+def random_segmentor(path, img_ch):
+    """Save the state dict of a randomly initialized segmentor to <path> and return <path>."""
+    torch.save(Optim_U_Net(img_ch=img_ch, output_ch=2).state_dict(), path)
+    return path
+
+
+def random_batch(opt):
+    """Return a batch of random images and labels in the layout of the unaligned dataset."""
+    n, size = opt.batch_size, opt.crop_size
+    batch = {'A': torch.rand(n, opt.input_nc, size, size) * 2 - 1, 'B': torch.rand(n, opt.output_nc, size, size) * 2 - 1,
+             'A_paths': ['A_%d' % i for i in range(n)], 'B_paths': ['B_%d' % i for i in range(n)]}
+    for domain in ['A', 'B']:
+        cell = (torch.rand(n, 1, size, size) > 0.9).to(torch.uint8) * 255
+        line = torch.randint(0, 3, (n, 1, size, size), dtype=torch.uint8) * 127
+        if not opt.compact_labels:
+            cell, line = cell.float() / 127.5 - 1, line.float() / 127.5 - 1
+        batch[domain + '_gt_cell'], batch[domain + '_gt_line'] = cell, line
+    return batch
+
+
+def synchronize(model):
+    if model.device.type == 'cuda':
+        torch.cuda.synchronize(model.device)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--modes', type=str, nargs='+', default=['none', 'compile', 'script'], help='--compile_mode values to compare')
+    parser.add_argument('--steps', type=int, default=20, help='number of training steps per mode')
+    parser.add_argument('--compile_steps', type=int, default=2, help='number of first steps that may compile and are reported separately')
+    bench, sys.argv[1:] = parser.parse_known_args()  # the rest are regular training options
+    assert bench.steps > bench.compile_steps, '--steps has to be larger than --compile_steps'
+    if '--dataroot' not in sys.argv:
+        sys.argv[1:1] = ['--dataroot', '.']  # no data is loaded
+    if '--gpu_ids' not in sys.argv:
+        sys.argv[1:1] = ['--gpu_ids', '-1']
+    opt = TrainOptions().gather_options()
+    opt.isTrain = True
+    opt.gpu_ids = [int(i) for i in opt.gpu_ids.split(',') if int(i) >= 0]
+    tmp_dir = tempfile.mkdtemp()
+    if not os.path.isfile(opt.A_domain_segmentor):
+        opt.A_domain_segmentor = random_segmentor(os.path.join(tmp_dir, 'A.pth'), opt.input_nc)
+    if not os.path.isfile(opt.B_domain_segmentor):
+        opt.B_domain_segmentor = random_segmentor(os.path.join(tmp_dir, 'B.pth'), opt.output_nc)
+    batch = random_batch(opt)
+
+    print('%-8s %16s %14s %10s' % ('mode', 'first steps s', 'step ms', 'speedup'))
+    baseline = None
+    for mode in bench.modes:
+        opt.compile_mode = mode
+        torch.manual_seed(0)
+        model = create_model(opt)
+        times = []
+        for _ in range(bench.steps):
+            start = time.perf_counter()
+            model.set_input(batch)
+            model.optimize_parameters()
+            synchronize(model)
+            times.append(time.perf_counter() - start)
+        steady = sorted(times[bench.compile_steps:])[len(times[bench.compile_steps:]) // 2] * 1000
+        baseline = baseline or steady
+        print('%-8s %16.2f %14.1f %9.2fx' % (mode, sum(times[:bench.compile_steps]), steady, baseline / steady))
+        del model
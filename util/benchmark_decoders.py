@@ -0,0 +1,51 @@
+"""Micro-benchmark of the image decoders in data/decoders.py on a sample of a dataset.
+
+It picks '--num_files' random files from the image and label directories of '--phase', reads
+them into memory once, and then reports the decode throughput of every installed backend per
+file format. Images are decoded as RGB and labels as grayscale, like UnalignedDataset does.
+
+Example:
+    python -m util.benchmark_decoders --dataroot ./datasets/skin --num_files 200
+"""
+import os
+import time
+import random
+import argparse
+from data.image_folder import make_dataset
+from data.decoders import available_decoders, get_decoder
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--dataroot', required=True, help='path to images (should have subfolders trainA, trainB, trainA_cell, etc)')
+    parser.add_argument('--phase', type=str, default='train', help='train, val, test, etc')
+    parser.add_argument('--num_files', type=int, default=200, help='number of files sampled from every directory')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed passes over the sample')
+    parser.add_argument('--decoders', type=str, nargs='+', default=available_decoders(), help='decoders to compare')
+    opt = parser.parse_args()
+
+    random.seed(0)
+    samples = {}  # file format -> list of (encoded bytes, mode)
+    for suffix, mode in [('A', 'RGB'), ('B', 'L'), ('A_cell', 'L'), ('B_cell', 'L'), ('A_layer', 'L'), ('B_layer', 'L')]:
+        dir_path = os.path.join(opt.dataroot, opt.phase + suffix)
+        if not os.path.isdir(dir_path):
+            continue
+        paths = make_dataset(dir_path)
+        for path in random.sample(paths, min(opt.num_files, len(paths))):
+            with open(path, 'rb') as f:
+                samples.setdefault(os.path.splitext(path)[1].lower(), []).append((f.read(), mode))
+
+    print('%-10s %-10s %8s %12s %10s' % ('format', 'decoder', 'files', 'files/s', 'MB/s'))
+    for fmt, files in sorted(samples.items()):
+        nbytes = sum(len(data) for data, _ in files)
+        for name in opt.decoders:
+            decode = get_decoder(name)
+            for data, mode in files:  # warm up, e.g. lazy library initialization
+                decode(data, mode)
+            start = time.perf_counter()
+            for _ in range(opt.repeat):
+                for data, mode in files:
+                    decode(data, mode)
+            elapsed = time.perf_counter() - start
+            print('%-10s %-10s %8d %12.1f %10.1f' % (fmt, name, len(files), opt.repeat * len(files) / elapsed,
+                                                    opt.repeat * nbytes / elapsed / 1e6))
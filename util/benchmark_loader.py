@@ -0,0 +1,75 @@
+"""Compare the data loading backends of CustomDatasetDataLoader ('--loader_backend').
+
+For every backend and every '--threads' value, it creates the data loader with the given
+training options, skips '--warmup' batches (worker start-up, first decodes) and then reports the
+throughput over '--num_batches' batches together with the resident memory of the training process
+and of its worker processes. RSS counts pages shared between processes once per process; where
+psutil is installed, USS (memory unique to each process) is reported as well.
+
+Example:
+    python -m util.benchmark_loader --dataroot ./datasets/skin --batch_size 4 --threads 0 2 4 8
+"""
+import os
+import sys
+import time
+import argparse
+from options.train_options import TrainOptions
+from data import CustomDatasetDataLoader
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def memory_mb():
+    """Return the (RSS, USS) in MB of this process and its children; USS is None without psutil."""
+    if psutil is None:
+        with open('/proc/self/statm') as f:  # Linux only; children are not counted
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6, None
+    processes = [psutil.Process()]
+    processes += processes[0].children(recursive=True)
+    rss = uss = 0
+    for process in processes:
+        try:
+            info = process.memory_full_info()
+        except psutil.Error:
+            continue
+        rss += info.rss
+        uss += info.uss
+    return rss / 1e6, uss / 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--backends', type=str, nargs='+', default=['process', 'thread'], help='loader backends to compare')
+    parser.add_argument('--threads', type=int, nargs='+', default=[0, 2, 4, 8], help='--num_threads values to compare')
+    parser.add_argument('--num_batches', type=int, default=100, help='number of timed batches')
+    parser.add_argument('--warmup', type=int, default=5, help='number of batches loaded before timing')
+    bench, sys.argv[1:] = parser.parse_known_args()  # the rest are regular training options
+    opt = TrainOptions().gather_options()
+    opt.isTrain = True
+    opt.gpu_ids = []  # measure loading only; batches stay on the host
+    opt.device_prefetch = 0
+
+    print('%-8s %8s %10s %12s %10s %10s' % ('backend', 'threads', 'batches/s', 'samples/s', 'RSS MB', 'USS MB'))
+    for backend in bench.backends:
+        for num_threads in bench.threads:
+            opt.loader_backend = backend
+            opt.num_threads = num_threads
+            loader = CustomDatasetDataLoader(opt)
+            batches = iter(loader.dataloader)
+            for _ in range(bench.warmup):
+                next(batches)
+            n_batches = n_samples = 0
+            start = time.perf_counter()
+            for data in batches:
+                n_batches += 1
+                n_samples += len(data['A'])
+                if n_batches == bench.num_batches:
+                    break
+            elapsed = time.perf_counter() - start
+            rss, uss = memory_mb()
+            del batches, loader  # shut the workers down before the next configuration
+            print('%-8s %8d %10.2f %12.1f %10.0f %10s' % (backend, num_threads, n_batches / elapsed, n_samples / elapsed,
+                                                          rss, '-' if uss is None else '%.0f' % uss))
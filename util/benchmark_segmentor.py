@@ -0,0 +1,76 @@
+"""Measure what head pruning of the Optim_U_Net segmentor ('heads' of its forward) saves.
+
+For every crop size and every head selection, it counts the multiply-accumulates of all
+convolutions of one forward pass with forward hooks (upsampling, normalization and activations
+are not counted) and times '--repeats' forward passes of a frozen segmentor after '--warmup'
+passes. The weights are random unless '--segmentor' gives a pretrained state dict; neither
+changes the cost.
+
+Example:
+    python -m util.benchmark_segmentor --crop_sizes 256 512 --batch_size 1 --img_ch 3 --device cuda:0
+"""
+import time
+import argparse
+import torch
+import torch.nn as nn
+from models.networks import Optim_U_Net, FrozenSegmentor
+
+
+def count_conv_flops(net, input, heads):
+    """Return the FLOPs (2 x multiply-accumulates) of the convolutions of one forward pass of <net>."""
+    flops = []
+
+    def hook(module, inputs, output):
+        kernel = module.kernel_size[0] * module.kernel_size[1] * module.in_channels // module.groups
+        flops.append(2 * kernel * output.numel())
+
+    handles = [module.register_forward_hook(hook) for module in net.modules() if isinstance(module, nn.Conv2d)]
+    try:
+        net(input, heads=heads)
+    finally:
+        for handle in handles:
+            handle.remove()
+    return sum(flops)
+
+
+def latency_ms(net, input, warmup, repeats):
+    """Return the mean time of one forward pass of <net> in milliseconds."""
+    for _ in range(warmup):
+        net(input)
+    if input.is_cuda:
+        torch.cuda.synchronize(input.device)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        net(input)
+    if input.is_cuda:
+        torch.cuda.synchronize(input.device)
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--crop_sizes', type=int, nargs='+', default=[256, 512], help='square input sizes to measure')
+    parser.add_argument('--batch_size', type=int, default=1, help='input batch size')
+    parser.add_argument('--img_ch', type=int, default=3, help='# of input image channels of the segmentor')
+    parser.add_argument('--segmentor', type=str, default='', help='optional path to a pretrained segmentor state dict')
+    parser.add_argument('--device', type=str, default='cuda:0' if torch.cuda.is_available() else 'cpu', help='device to time on')
+    parser.add_argument('--precision', type=str, default='fp32', help='segmentor precision [fp32 | fp16 | bf16]')
+    parser.add_argument('--warmup', type=int, default=5, help='number of untimed forward passes')
+    parser.add_argument('--repeats', type=int, default=20, help='number of timed forward passes')
+    opt = parser.parse_args()
+
+    device = torch.device(opt.device)
+    net = Optim_U_Net(img_ch=opt.img_ch, output_ch=2)
+    if opt.segmentor:
+        net.load_state_dict(torch.load(opt.segmentor, map_location='cpu'))
+    selections = [('d1', 'dm', 'da'), ('d1',)]
+    segmentors = [FrozenSegmentor(net, opt.precision, heads).to(device) for heads in selections]  # all share <net>
+
+    print('%6s %-10s %12s %8s %12s %8s' % ('size', 'heads', 'GFLOPs', 'saved', 'latency ms', 'speedup'))
+    for size in opt.crop_sizes:
+        input = torch.rand(opt.batch_size, opt.img_ch, size, size, device=device)
+        with torch.no_grad():
+            flops = [count_conv_flops(net, input.to(segmentors[0].dtype), heads) for heads in selections]
+        times = [latency_ms(segmentor, input, opt.warmup, opt.repeats) for segmentor in segmentors]
+        for heads, f, t in zip(selections, flops, times):
+            print('%6d %-10s %12.2f %7.1f%% %12.2f %7.2fx' % (size, ','.join(heads), f / 1e9, 100 * (1 - f / flops[0]), t, times[0] / t))
@@ -0,0 +1,24 @@
+"""Build the near-duplicate index used by '--dedup' (see data/dedup_index.py).
+
+Example:
+    python -m util.build_dedup_index --dataroot ./datasets/skin --phase train --max_distance 6
+"""
+import argparse
+from data.manifest import Manifest
+from data.dedup_index import build_dedup_index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--dataroot', required=True, help='path to images (should have subfolders trainA, trainB, trainA_cell, etc)')
+    parser.add_argument('--phase', type=str, nargs='+', default=['train'], help='phases to index')
+    parser.add_argument('--max_distance', type=int, default=6, help='tiles whose 64-bit hashes differ in at most this many bits are near-duplicates')
+    parser.add_argument('--decoder', type=str, default='pil', help='image decoding backend [pil | pil_draft | cv2 | turbojpeg]')
+    opt = parser.parse_args()
+
+    for phase in opt.phase:
+        manifest = Manifest(opt.dataroot, phase)
+        for domain in ['A', 'B']:
+            n, n_clusters = build_dedup_index(opt.dataroot, phase, domain, manifest, opt.max_distance, opt.decoder)
+            print('%s%s: %d images in %d clusters of near-duplicates' % (phase, domain, n, n_clusters))
+        manifest.save()
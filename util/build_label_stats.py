@@ -0,0 +1,23 @@
+"""Build the label statistics index used by '--label_stats' (see data/label_stats.py).
+
+Example:
+    python -m util.build_label_stats --dataroot ./datasets/skin --phase train test
+"""
+import argparse
+from data.manifest import Manifest
+from data.label_stats import build_label_stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--dataroot', required=True, help='path to images (should have subfolders trainA, trainB, trainA_cell, etc)')
+    parser.add_argument('--phase', type=str, nargs='+', default=['train', 'test'], help='phases to index')
+    parser.add_argument('--decoder', type=str, default='pil', help='image decoding backend [pil | pil_draft | cv2 | turbojpeg]')
+    opt = parser.parse_args()
+
+    for phase in opt.phase:
+        manifest = Manifest(opt.dataroot, phase)
+        for domain in ['A', 'B']:
+            n = build_label_stats(opt.dataroot, phase, domain, manifest, opt.decoder)
+            print('indexed the labels of %d images of %s%s' % (n, phase, domain))
+        manifest.save()
@@ -0,0 +1,26 @@
+"""Pack the cell and layer label masks of an unaligned dataset for '--packed_labels'.
+
+It reads the '[phase]A_cell', '[phase]A_layer', '[phase]B_cell' and '[phase]B_layer' directories under
+'--dataroot' and writes one bit-packed '.labels' file (plus its '.labels.json' index) per directory.
+
+Example:
+    python -m util.pack_labels --dataroot ./datasets/skin --phase train test
+"""
+import argparse
+from data.manifest import Manifest
+from data.label_pack import pack_labels
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--dataroot', required=True, help='path to images (should have subfolders trainA, trainB, trainA_cell, etc)')
+    parser.add_argument('--phase', type=str, nargs='+', default=['train', 'test'], help='phases to pack')
+    parser.add_argument('--max_dataset_size', type=int, default=float("inf"), help='maximum number of samples to pack per domain')
+    opt = parser.parse_args()
+
+    for phase in opt.phase:
+        manifest = Manifest(opt.dataroot, phase)
+        for domain in ['A', 'B']:
+            n, nbytes = pack_labels(opt.dataroot, phase, domain, opt.max_dataset_size, manifest)
+            print('packed the labels of %d samples of %s%s into %.1f MB' % (n, phase, domain, nbytes / 1e6))
+        manifest.save()
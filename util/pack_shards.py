@@ -0,0 +1,24 @@
+"""Pack an unaligned dataset into memory-mapped shards for '--dataset_mode shard'.
+
+It reads the '[phase]A', '[phase]B', '[phase]A_cell', '[phase]B_cell', '[phase]A_layer' and
+'[phase]B_layer' directories under '--dataroot' and writes '[phase]A.shard' and '[phase]B.shard'
+(plus their '.shard.json' indexes) next to them.
+
+Example:
+    python -m util.pack_shards --dataroot ./datasets/skin --phase train test
+"""
+import argparse
+from data.shard_store import pack_domain
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--dataroot', required=True, help='path to images (should have subfolders trainA, trainB, trainA_cell, etc)')
+    parser.add_argument('--phase', type=str, nargs='+', default=['train', 'test'], help='phases to pack')
+    parser.add_argument('--max_dataset_size', type=int, default=float("inf"), help='maximum number of samples to pack per domain')
+    opt = parser.parse_args()
+
+    for phase in opt.phase:
+        for domain in ['A', 'B']:
+            n = pack_domain(opt.dataroot, phase, domain, opt.max_dataset_size)
+            print('packed %d samples into %s%s.shard' % (n, phase, domain))
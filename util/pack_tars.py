@@ -0,0 +1,29 @@
+"""Pack an unaligned dataset into sequential tar shards for '--dataset_mode tar'.
+
+It reads the '[phase]A', '[phase]B', '[phase]A_cell', '[phase]B_cell', '[phase]A_layer' and
+'[phase]B_layer' directories under '--dataroot' and writes the shards to '[phase]A.tars/' and
+'[phase]B.tars/' next to them (see data/tar_store.py).
+
+Example:
+    python -m util.pack_tars --dataroot ./datasets/skin --phase train --samples_per_shard 1000
+"""
+import argparse
+from data.manifest import Manifest
+from data.tar_store import pack_tars
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--dataroot', required=True, help='path to images (should have subfolders trainA, trainB, trainA_cell, etc)')
+    parser.add_argument('--phase', type=str, nargs='+', default=['train', 'test'], help='phases to pack')
+    parser.add_argument('--samples_per_shard', type=int, default=1000, help='number of samples per tar file; use at least as many shards as data loading workers')
+    parser.add_argument('--max_dataset_size', type=int, default=float("inf"), help='maximum number of samples to pack per domain')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the order in which the samples are packed')
+    opt = parser.parse_args()
+
+    for phase in opt.phase:
+        manifest = Manifest(opt.dataroot, phase)
+        for domain in ['A', 'B']:
+            n = pack_tars(opt.dataroot, phase, domain, opt.samples_per_shard, opt.max_dataset_size, manifest, opt.seed)
+            print('packed %d samples into %s%s.tars' % (n, phase, domain))
+        manifest.save()
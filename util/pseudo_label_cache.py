@@ -0,0 +1,66 @@
+import torch
+
+
+class PseudoLabelCache():
+    """This class implements a cache of the nuclei that a segmentor predicts on generated images.
+
+    Predicting the nuclei of every fake image costs a full U-Net pass per domain and step. The cache
+    keeps the predicted mask of every sample, keyed by the path of the real image the fake one was
+    generated from, and reuses it until it is due for a refresh or older than the staleness budget.
+    Only the samples that have to be refreshed are passed through the segmentor. Cached masks only
+    match the current fake image if the sample is loaded with the same geometry every time, i.e.
+    without random crops, flips or rotations.
+    """
+
+    def __init__(self, refresh_every, max_staleness, mode='step'):
+        """Initialize the PseudoLabelCache class
+
+        Parameters:
+            refresh_every (int) -- refresh the cached masks every <refresh_every> steps
+            max_staleness (int) -- a cached mask is never reused more than <max_staleness> steps after it was predicted
+            mode (str)          -- step: refresh every sample of the batch every <refresh_every> steps;
+                                   rotate: refresh a rotating 1 / <refresh_every> of the batch every step
+        """
+        if mode not in ['step', 'rotate']:
+            raise NotImplementedError('pseudo-label refresh mode [%s] is not recognized' % mode)
+        self.refresh_every = refresh_every
+        self.max_staleness = max_staleness
+        self.mode = mode
+        self.entries = {}  # key -> (mask, step it was predicted at)
+        self.step = 0
+        self.hit_rate = 0.0   # fraction of the last batch served from the cache
+        self.staleness = 0.0  # mean age in steps of the masks of the last batch; 0 for fresh predictions
+
+    def due(self, position):
+        """Return whether the sample at batch position <position> has to be refreshed in this step."""
+        if self.mode == 'step':
+            return self.step % self.refresh_every == 0
+        return (position + self.step) % self.refresh_every == 0
+
+    def query(self, segment, images, keys):
+        """Return the masks of a batch of images, predicting only the ones that are not cached, due or too stale.
+
+        Parameters:
+            segment (function) -- maps a batch of images to a batch of masks
+            images (tensor)    -- the latest generated images
+            keys (str list)    -- one key per image, e.g. the path of the real image it was generated from
+
+        Returns the masks of all <images>, in the same order.
+        """
+        self.step += 1
+        refresh = []
+        for i, key in enumerate(keys):
+            entry = self.entries.get(key)
+            if entry is None or self.due(i) or self.step - entry[1] > self.max_staleness or entry[0].shape[1:] != images.shape[2:]:
+                refresh.append(i)
+        if refresh:
+            if len(refresh) < len(keys):
+                images = images.index_select(0, torch.tensor(refresh, device=images.device))
+            masks = segment(images)
+            for mask, i in zip(masks, refresh):
+                self.entries[keys[i]] = (mask, self.step)
+        self.hit_rate = 1 - len(refresh) / len(keys)
+        self.staleness = sum(self.step - self.entries[key][1] for key in keys) / len(keys)
+        if self.step % max(self.max_staleness, 1) == 0:  # drop the masks that may no longer be reused
+            self.entries = {key: entry for key, entry in self.entries.items() if self.step - entry[1] <= self.max_staleness}
+        return torch.stack([self.entries[key][0] for key in keys], 0)